@@ -0,0 +1,86 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+"""
+Measure how long `import opnieuw` takes, and fail if it exceeds a budget.
+
+Every run imports opnieuw in a fresh interpreter with `-X importtime`, and the
+fastest of the runs is compared against the budget, to filter out noise. The
+slowest modules imported along with opnieuw are listed to help find regressions.
+
+Usage, from the repository root:
+
+    python -m benchmarks.bench_import_time [--runs N] [--budget-ms MS]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Modules that `import opnieuw` must not pull in, because they are only needed
+# by async code, for type checking, or once something is actually retried.
+FORBIDDEN_MODULES = ("asyncio", "inspect", "logging", "typing_extensions")
+
+
+def measure(module: str) -> tuple[float, list[tuple[float, str]], set[str]]:
+    """
+    Import `module` in a fresh interpreter. Returns its cumulative import time in
+    milliseconds, the self time in milliseconds of every imported module, and the
+    names of the imported modules.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+    )
+
+    total_ms = 0.0
+    self_times = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        self_times.append((int(self_us) / 1000, name.strip()))
+        if name.strip() == module:
+            total_ms = int(cumulative_us) / 1000
+
+    return total_ms, self_times, {name for _, name in self_times}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=40.0)
+    parser.add_argument("--module", default="opnieuw")
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    best_ms, self_times, modules = min(runs, key=lambda run: run[0])
+
+    print(f"import {args.module}: {best_ms:.2f} ms (best of {args.runs} runs)")
+    print("Slowest modules (self time):")
+    for ms, name in sorted(self_times, reverse=True)[:10]:
+        print(f"  {ms:>7.2f} ms  {name}")
+
+    failures = []
+    if best_ms > args.budget_ms:
+        failures.append(f"import took {best_ms:.2f} ms, budget is {args.budget_ms:.2f} ms")
+    for name in FORBIDDEN_MODULES:
+        if name in modules:
+            failures.append(f"{name} was imported")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+"""
+Measure how the throughput of calls to a `retry` decorated function scales with
+the number of threads.
+
+On free-threaded Python builds (3.13t, 3.14t) the throughput should grow with the
+number of cores, because calls do not share any locks. On builds with the GIL the
+throughput stays flat, which this benchmark reports as well.
+
+Usage, from the repository root:
+
+    python -m benchmarks.bench_thread_scaling [--calls-per-thread N] [--profiler]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+from opnieuw import retry
+from opnieuw.profiler import disable_profiler, enable_profiler
+
+
+@retry(retry_on_exceptions=ValueError, namespace="bench_thread_scaling")
+def succeed(x: int) -> int:
+    return x
+
+
+def run(n_threads: int, calls_per_thread: int) -> float:
+    """Return the number of calls per second with `n_threads` threads."""
+    barrier = threading.Barrier(n_threads + 1)
+
+    def _worker() -> None:
+        barrier.wait()
+        for i in range(calls_per_thread):
+            succeed(i)
+
+    threads = [threading.Thread(target=_worker) for _ in range(n_threads)]
+    for t in threads:
+        t.start()
+
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    return n_threads * calls_per_thread / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls-per-thread", type=int, default=200_000)
+    parser.add_argument(
+        "--profiler", action="store_true", help="Run with the profiler enabled."
+    )
+    args = parser.parse_args()
+
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"Python {sys.version.split()[0]}, GIL enabled: {is_gil_enabled}")
+
+    if args.profiler:
+        enable_profiler()
+
+    n_cores = os.cpu_count() or 1
+    thread_counts = sorted({n for n in (1, 2, 4, 8) if n <= n_cores} | {n_cores})
+
+    baseline = None
+    for n_threads in thread_counts:
+        throughput = run(n_threads, args.calls_per_thread)
+        if baseline is None:
+            baseline = throughput
+        print(
+            f"{n_threads:>3} threads: {throughput:>12,.0f} calls/s "
+            f"(speedup {throughput / baseline:.2f}x)"
+        )
+
+    disable_profiler()
+
+
+if __name__ == "__main__":
+    main()
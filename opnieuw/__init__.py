@@ -4,8 +4,9 @@
 # Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
 
 from .exceptions import RetryException
+from .priority import Priority
 from .retries import retry, retry_async
 
-__all__ = ["retry_async", "retry", "RetryException"]
+__all__ = ["retry_async", "retry", "RetryException", "Priority"]
 
 __version__ = "3.3.0"
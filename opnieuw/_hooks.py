@@ -0,0 +1,36 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+"""
+Process-wide extension points of the retry decorators.
+
+The optional features install themselves here, so that `opnieuw.retries` can check
+whether they are enabled without importing the modules that implement them. This
+keeps `import opnieuw` cheap for programs that do not use them.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .coordinator import Coordinator
+    from .overload import OverloadDetector
+    from .profiler import RetryProfiler
+
+# Outcomes of a single call of a decorated function, as recorded by the profiler.
+SUCCEEDED = 0
+GAVE_UP = 1
+FAILED = 2
+
+# See `opnieuw.profiler.enable_profiler`.
+profiler: RetryProfiler | None = None
+
+# See `opnieuw.coordinator.set_coordinator`.
+coordinator: Coordinator | None = None
+
+# See `opnieuw.overload.set_overload_detector`.
+overload_detector: OverloadDetector | None = None
+overload_delay_factor: float | None = None
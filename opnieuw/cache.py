@@ -0,0 +1,151 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+"""
+Caching of results of retried functions.
+
+Pass a `ResultCache` as the `cache` argument of the `retry` decorator to cache the
+results of idempotent functions by their arguments. The cache also remembers, for
+`negative_ttl_seconds`, the arguments for which the function just exhausted its
+retries. Calls with those arguments fail fast with a copy of the final exception,
+instead of going through the whole backoff sequence against a
+dependency that is known to be broken.
+"""
+
+from __future__ import annotations
+
+import copy
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Hashable, Mapping
+from typing import Any
+
+from .clock import Clock, MonotonicClock
+
+logger = logging.getLogger(__name__)
+
+# Separates positional from keyword arguments in cache keys.
+_KWARGS_MARK = object()
+
+
+class _Entry:
+    __slots__ = ("expires_at", "value", "exception")
+
+    def __init__(
+        self, expires_at: float, value: Any, exception: Exception | None = None
+    ) -> None:
+        self.expires_at = expires_at
+        self.value = value
+        self.exception = exception
+
+
+class ResultCache:
+    """
+    A bounded LRU cache of results, which expire after `ttl_seconds`, and of
+    exhausted retries, which expire after `negative_ttl_seconds`.
+
+    A cache holds at most `maxsize` entries, successes and failures together, and
+    can be shared between multiple decorated functions only if their arguments
+    don't overlap. Calls with unhashable arguments are not cached.
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl_seconds: float,
+        negative_ttl_seconds: float = 0.0,
+        maxsize: int = 128,
+        clock: Clock | None = None,
+    ) -> None:
+        if maxsize < 1:
+            raise ValueError(f"`maxsize` must be positive, got {maxsize}")
+
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.maxsize = maxsize
+        self.clock = MonotonicClock() if clock is None else clock
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def make_key(
+        self, args: tuple[Any, ...], kwargs: Mapping[str, Any]
+    ) -> Hashable | None:
+        """Returns the cache key for the given arguments, or None if they are unhashable."""
+        key: tuple[Any, ...] = args
+        if kwargs:
+            key += (_KWARGS_MARK, *sorted(kwargs.items()))
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def get(self, key: Hashable) -> tuple[bool, Any]:
+        """
+        Returns whether there is a result for the key and the result, if any.
+
+        If the key recently exhausted its retries, a copy of the final exception
+        is raised instead.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            if entry.expires_at <= self.clock.seconds_since_epoch():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+
+        if entry.exception is not None:
+            # A new exception for every hit, as concurrent raises of one instance
+            # would change its traceback and context under each other.
+            raise copy.copy(entry.exception)
+        return True, entry.value
+
+    def _put(self, key: Hashable, entry: _Entry) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Cache a successful result."""
+        if self.ttl_seconds <= 0:
+            return
+        expires_at = self.clock.seconds_since_epoch() + self.ttl_seconds
+        self._put(key, _Entry(expires_at, value))
+
+    def set_failure(self, key: Hashable, exception: Exception) -> None:
+        """
+        Remember that the key exhausted its retries with the given exception.
+
+        A copy of the exception is kept, including its attributes, but without
+        its traceback, cause and context, which would keep the frames of every
+        attempt alive. Exceptions that cannot be copied are not cached.
+        """
+        if self.negative_ttl_seconds <= 0:
+            return
+        try:
+            stored = copy.copy(exception)
+        except Exception as e:
+            logger.warning(
+                f"Not caching the failure for {key!r}, "
+                f"{type(exception).__name__} cannot be copied: {e!r}"
+            )
+            return
+        stored.__traceback__ = None
+        stored.__cause__ = None
+        stored.__context__ = None
+        expires_at = self.clock.seconds_since_epoch() + self.negative_ttl_seconds
+        self._put(key, _Entry(expires_at, None, stored))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -3,6 +3,9 @@
 #
 # Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
 
+from __future__ import annotations
+
+import threading
 import time
 from abc import ABC, abstractmethod
 
@@ -12,6 +15,17 @@ class Clock(ABC):
     def seconds_since_epoch(self) -> float:
         """Returns seconds since epoch."""
 
+    def sleep(self, seconds: float) -> None:
+        """Blocks the current thread for the given amount of seconds."""
+        time.sleep(seconds)
+
+    async def async_sleep(self, seconds: float) -> None:
+        """Suspends the current asyncio task for the given amount of seconds."""
+        # Imported here so that sync-only programs don't pay for importing asyncio.
+        import asyncio
+
+        await asyncio.sleep(seconds)
+
 
 class MonotonicClock(Clock):
     """Effectual clock for use in production."""
@@ -21,10 +35,26 @@ class MonotonicClock(Clock):
 
 
 class DummyClock(Clock):
-    """Fake clock for use in tests."""
+    """
+    Fake clock for use in tests.
+
+    Sleeping on this clock does not wait, it advances the virtual time instead.
+    Concurrent sleeps overlap in virtual time, like real sleeps would: the clock
+    advances to the earliest wake-up time of all sleepers, and only that sleeper
+    wakes up. A sleeper first lets the other asyncio tasks run until they sleep
+    as well. Threads wait up to `thread_grace_seconds` of real time for the other
+    threads to go to sleep, when there are other threads.
+    """
+
+    thread_grace_seconds = 0.005
 
     def __init__(self) -> None:
         self.time = 0.0
+        self._condition = threading.Condition()
+        # Sleepers as (wake-up time, registration number), so that sleepers with
+        # the same wake-up time wake up in the order in which they went to sleep.
+        self._sleepers: list[tuple[float, int]] = []
+        self._registrations = 0
 
     def advance_to(self, t: float) -> None:
         assert t >= self.time, "Clock should not go backwards"
@@ -32,3 +62,57 @@ class DummyClock(Clock):
 
     def seconds_since_epoch(self) -> float:
         return self.time
+
+    def _go_to_sleep(self, seconds: float) -> tuple[float, int]:
+        with self._condition:
+            self._registrations += 1
+            sleeper = (self.time + seconds, self._registrations)
+            self._sleepers.append(sleeper)
+            return sleeper
+
+    def _wake_up(self, sleeper: tuple[float, int], *, advance: bool) -> None:
+        with self._condition:
+            self._sleepers.remove(sleeper)
+            if advance and sleeper[0] > self.time:
+                self.time = sleeper[0]
+            self._condition.notify_all()
+
+    def sleep(self, seconds: float) -> None:
+        sleeper = self._go_to_sleep(seconds)
+        woke_up = False
+        try:
+            with self._condition:
+                while True:
+                    # Without other threads, nobody else can wake up first.
+                    if threading.active_count() == 1:
+                        break
+                    if min(self._sleepers) != sleeper:
+                        self._condition.wait()
+                        continue
+                    registrations = self._registrations
+                    deadline = time.monotonic() + self.thread_grace_seconds
+                    while (remaining := deadline - time.monotonic()) > 0:
+                        self._condition.wait(remaining)
+                    if registrations == self._registrations and min(self._sleepers) == sleeper:
+                        break
+            woke_up = True
+        finally:
+            self._wake_up(sleeper, advance=woke_up)
+
+    async def async_sleep(self, seconds: float) -> None:
+        import asyncio
+
+        sleeper = self._go_to_sleep(seconds)
+        woke_up = False
+        try:
+            while True:
+                registrations = self._registrations
+                # Still yield to the event loop, like a real sleep would, so that
+                # other tasks get a chance to run and go to sleep too.
+                await asyncio.sleep(0)
+                with self._condition:
+                    if registrations == self._registrations and min(self._sleepers) == sleeper:
+                        break
+            woke_up = True
+        finally:
+            self._wake_up(sleeper, advance=woke_up)
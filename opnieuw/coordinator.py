@@ -0,0 +1,401 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+"""
+Host-wide coordination of backoffs.
+
+Processes report retried failures per namespace to a coordinator. Once a namespace
+fails often enough on the host, the coordinator tells every process to back off
+from it for a while, and `BackoffCalculator` will not schedule a retry before
+that time has passed.
+
+The coordinator can run as a small daemon on a Unix domain socket:
+
+    python -m opnieuw.coordinator --mode 660 /run/opnieuw/coordinator.sock
+
+Processes then talk to it through a `CoordinatorClient`, which batches failure
+reports and fetches the backoff signals in a background thread, so calls of
+decorated functions never block on the coordinator. `LocalCoordinator` is an
+in-process stand-in for tests and single-process use.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import math
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import IO
+
+from . import _hooks
+from .clock import Clock, MonotonicClock
+
+logger = logging.getLogger(__name__)
+
+
+class Coordinator(ABC):
+    @abstractmethod
+    def report_failure(self, namespace: str | None) -> None:
+        """
+        Report a retried failure in the given namespace. Must not block.
+        """
+
+    @abstractmethod
+    def remaining_backoff(self, namespace: str | None) -> float:
+        """
+        Returns the number of seconds that the host should still back off from the
+        given namespace, or 0 if there is no host-wide backoff. Must not block.
+        """
+
+
+class _NamespaceFailures:
+    __slots__ = ("window_start", "failures", "backoff_until", "trips")
+
+    def __init__(self, now: float) -> None:
+        self.window_start = now
+        self.failures = 0
+        self.backoff_until = -math.inf
+        self.trips = 0
+
+
+class FailureTracker:
+    """
+    Decides when a namespace should be backed off from, based on the failures
+    reported for it.
+
+    Once `failure_threshold` failures are reported within `window_seconds`, the
+    namespace is backed off from for `backoff_seconds`. If it trips again shortly
+    after the backoff ended, the backoff doubles, up to `max_backoff_seconds`.
+
+    This class is not thread-safe, callers are responsible for locking.
+    """
+
+    def __init__(
+        self,
+        clock: Clock,
+        *,
+        failure_threshold: int = 10,
+        window_seconds: float = 10.0,
+        backoff_seconds: float = 5.0,
+        max_backoff_seconds: float = 60.0,
+    ) -> None:
+        self.clock = clock
+        self.failure_threshold = failure_threshold
+        self.window_seconds = window_seconds
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._namespaces: dict[str | None, _NamespaceFailures] = {}
+
+    def add_failures(self, namespace: str | None, count: int) -> None:
+        now = self.clock.seconds_since_epoch()
+        state = self._namespaces.get(namespace)
+        if state is None:
+            state = self._namespaces[namespace] = _NamespaceFailures(now)
+
+        if now - state.window_start >= self.window_seconds:
+            state.window_start = now
+            state.failures = 0
+
+        state.failures += count
+        if state.failures < self.failure_threshold or now < state.backoff_until:
+            return
+
+        if now - state.backoff_until < self.window_seconds:
+            state.trips += 1
+        else:
+            state.trips = 1
+        backoff_seconds = min(
+            self.backoff_seconds * 2 ** (state.trips - 1), self.max_backoff_seconds
+        )
+        state.backoff_until = now + backoff_seconds
+        state.window_start = now
+        state.failures = 0
+        logger.info(
+            f"Namespace {namespace!r} failed too often, backing off for {backoff_seconds:.3f}s."
+        )
+
+    def remaining_backoff(self, namespace: str | None) -> float:
+        state = self._namespaces.get(namespace)
+        if state is None:
+            return 0.0
+        return max(0.0, state.backoff_until - self.clock.seconds_since_epoch())
+
+    def backoffs(self) -> dict[str | None, float]:
+        """Returns the remaining backoff of every namespace that is backed off from."""
+        now = self.clock.seconds_since_epoch()
+        return {
+            namespace: state.backoff_until - now
+            for namespace, state in self._namespaces.items()
+            if state.backoff_until > now
+        }
+
+
+class LocalCoordinator(Coordinator):
+    """
+    In-process coordinator, for tests and for sharing backoffs between the threads
+    and tasks of a single process.
+    """
+
+    def __init__(self, tracker: FailureTracker | None = None) -> None:
+        self.tracker = FailureTracker(MonotonicClock()) if tracker is None else tracker
+        self._lock = threading.Lock()
+
+    def report_failure(self, namespace: str | None) -> None:
+        with self._lock:
+            self.tracker.add_failures(namespace, 1)
+
+    def remaining_backoff(self, namespace: str | None) -> float:
+        with self._lock:
+            return self.tracker.remaining_backoff(namespace)
+
+
+# The wire protocol is newline-delimited JSON. Clients send
+#     {"failures": [[namespace, count], ...]}
+# and the coordinator replies with the backoffs of all namespaces:
+#     {"backoffs": [[namespace, remaining_seconds], ...]}
+# Namespaces are encoded as lists of pairs because the default namespace is null.
+
+
+class CoordinatorClient(Coordinator):
+    """
+    Client for a coordinator daemon listening on the Unix domain socket at `path`.
+
+    Failures are counted in memory and sent to the daemon in batches every
+    `flush_interval_seconds` by a background thread, which also fetches the latest
+    backoffs. If the daemon is unreachable, no host-wide backoffs apply.
+    """
+
+    def __init__(self, path: str, *, flush_interval_seconds: float = 0.5) -> None:
+        self.path = path
+        self.flush_interval_seconds = flush_interval_seconds
+        self._lock = threading.Lock()
+        self._pending: dict[str | None, int] = {}
+        # Monotonic deadlines per namespace, replaced as a whole on every flush.
+        self._backoff_until: dict[str | None, float] = {}
+        self._stop = threading.Event()
+        # Serializes flushes, which own the connection.
+        self._flush_lock = threading.Lock()
+        self._socket: socket.socket | None = None
+        self._reader: IO[str] | None = None
+        self._thread = threading.Thread(
+            target=self._run, name="opnieuw-coordinator-client", daemon=True
+        )
+        self._thread.start()
+
+    def report_failure(self, namespace: str | None) -> None:
+        with self._lock:
+            self._pending[namespace] = self._pending.get(namespace, 0) + 1
+
+    def remaining_backoff(self, namespace: str | None) -> float:
+        backoff_until = self._backoff_until.get(namespace)
+        if backoff_until is None:
+            return 0.0
+        return max(0.0, backoff_until - time.monotonic())
+
+    def close(self) -> None:
+        """Stop the background thread and disconnect from the daemon."""
+        self._stop.set()
+        self._thread.join()
+        with self._flush_lock:
+            self._disconnect()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval_seconds):
+            self.flush()
+
+    def flush(self) -> None:
+        """Send the pending failures and fetch the backoffs right away."""
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        request = json.dumps({"failures": list(pending.items())}) + "\n"
+        try:
+            if self._socket is None:
+                self._connect()
+            assert self._socket is not None and self._reader is not None
+            self._socket.sendall(request.encode())
+            reply = self._reader.readline()
+            if not reply:
+                raise ConnectionError("Coordinator closed the connection")
+        except (OSError, ValueError) as e:
+            logger.debug(f"Could not reach the coordinator at {self.path}: {e}")
+            self._disconnect()
+            self._backoff_until = {}
+            return
+
+        now = time.monotonic()
+        try:
+            self._backoff_until = {
+                namespace: now + remaining
+                for namespace, remaining in json.loads(reply)["backoffs"]
+            }
+        except (KeyError, TypeError, ValueError) as e:
+            # A partial line from a daemon that died mid-write, or a reply of
+            # another protocol version. Reconnect on the next flush.
+            logger.warning(f"Invalid reply from the coordinator at {self.path}: {e}")
+            self._disconnect()
+            self._backoff_until = {}
+
+    def _connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(max(self.flush_interval_seconds, 1.0))
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._socket = sock
+        self._reader = sock.makefile("r", encoding="utf-8")
+
+    def _disconnect(self) -> None:
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+def _parse_request(line: bytes) -> list[tuple[str | None, int]]:
+    """
+    Returns the failures reported in a request line, or raises ValueError if the
+    line is not a valid request.
+    """
+    try:
+        failures = json.loads(line)["failures"]
+        parsed = [(namespace, count) for namespace, count in failures]
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Malformed request: {e}") from e
+
+    for namespace, count in parsed:
+        if namespace is not None and not isinstance(namespace, str):
+            raise ValueError(f"Namespace must be a string or null, got {namespace!r}")
+        if not isinstance(count, int) or isinstance(count, bool) or count < 0:
+            raise ValueError(f"Count must be a non-negative integer, got {count!r}")
+    return parsed
+
+
+class _CoordinatorHandler(socketserver.StreamRequestHandler):
+    server: CoordinatorServer
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                failures = _parse_request(line)
+            except ValueError as e:
+                # Skip the line, but still reply so that the client does not wait.
+                logger.warning(f"Ignoring an invalid request from a client: {e}")
+                failures = []
+            with self.server.lock:
+                for namespace, count in failures:
+                    self.server.tracker.add_failures(namespace, count)
+                backoffs = self.server.tracker.backoffs()
+            reply = json.dumps({"backoffs": list(backoffs.items())}) + "\n"
+            self.wfile.write(reply.encode())
+
+
+def _remove_stale_socket(path: str) -> None:
+    """
+    Remove the socket file at `path` if nobody listens on it, such as after the
+    previous daemon crashed. A socket that is in use is left alone.
+    """
+    try:
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            return
+    except FileNotFoundError:
+        return
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except ConnectionRefusedError:
+            logger.info(f"Removing the stale socket at {path}.")
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+class CoordinatorServer(socketserver.ThreadingUnixStreamServer):
+    """
+    The coordinator daemon, serving clients on the Unix domain socket at `path`.
+
+    A stale socket file at `path` is removed first. If `mode` is given, the
+    permissions of the socket are set to it, to control which users can connect.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, path: str, tracker: FailureTracker | None = None, *, mode: int | None = None
+    ) -> None:
+        self.tracker = FailureTracker(MonotonicClock()) if tracker is None else tracker
+        self.lock = threading.Lock()
+        self.mode = mode
+        self._bound = False
+        super().__init__(path, _CoordinatorHandler)
+
+    def server_bind(self) -> None:
+        _remove_stale_socket(self.server_address)
+        super().server_bind()
+        self._bound = True
+        if self.mode is not None:
+            os.chmod(self.server_address, self.mode)
+
+    def server_close(self) -> None:
+        super().server_close()
+        # If binding failed, the socket file belongs to another daemon.
+        if self._bound:
+            os.unlink(self.server_address)
+
+
+def set_coordinator(coordinator: Coordinator | None) -> None:
+    """
+    Report retried failures to the given coordinator and respect its backoffs.
+    None disables host-wide coordination again.
+    """
+    _hooks.coordinator = coordinator
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Run the opnieuw coordinator daemon on a Unix domain socket."
+    )
+    parser.add_argument("path", help="Path of the Unix domain socket to listen on.")
+    parser.add_argument("--failure-threshold", type=int, default=10)
+    parser.add_argument("--window-seconds", type=float, default=10.0)
+    parser.add_argument("--backoff-seconds", type=float, default=5.0)
+    parser.add_argument("--max-backoff-seconds", type=float, default=60.0)
+    parser.add_argument(
+        "--mode",
+        type=lambda mode: int(mode, 8),
+        help="Permissions of the socket in octal, such as 660.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    tracker = FailureTracker(
+        MonotonicClock(),
+        failure_threshold=args.failure_threshold,
+        window_seconds=args.window_seconds,
+        backoff_seconds=args.backoff_seconds,
+        max_backoff_seconds=args.max_backoff_seconds,
+    )
+    with CoordinatorServer(args.path, tracker, mode=args.mode) as server:
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
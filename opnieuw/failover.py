@@ -0,0 +1,284 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+"""
+Retries that fail over between a pool of targets, such as the replicas of a
+service.
+
+`retry_with_failover` passes a target from a `TargetPool` to the decorated function
+on every attempt. The pool keeps a health score per target, based on its recent
+error rate and latency, and every attempt goes to the healthiest target that was
+not tried yet. When a retry can go to a healthy target that was not tried yet, it
+is made right away instead of after a backoff.
+"""
+
+from __future__ import annotations
+
+import functools
+import random
+import threading
+import warnings
+from collections.abc import Callable, Sequence
+from typing import TYPE_CHECKING, Any, Generic, TypeVar, cast
+
+from .clock import Clock, MonotonicClock
+from .retries import RetriedCall, RetriedFunction
+
+if TYPE_CHECKING:
+    import sys
+    from collections.abc import Awaitable
+
+    if sys.version_info < (3, 10):
+        from typing_extensions import Concatenate, ParamSpec
+    else:
+        from typing import Concatenate, ParamSpec
+
+    P = ParamSpec("P")
+
+R = TypeVar("R")
+T = TypeVar("T")
+
+
+class _TargetHealth:
+    __slots__ = ("error_rate", "latency_seconds", "updated_at")
+
+    def __init__(self, now: float) -> None:
+        self.error_rate = 0.0
+        self.latency_seconds = 0.0
+        self.updated_at = now
+
+
+class TargetPool(Generic[T]):
+    """
+    A pool of targets with a health score per target.
+
+    The error rate of a target is a moving average of its outcomes, with weight
+    `smoothing` for the latest outcome, that decays back to zero with a half-life
+    of `half_life_seconds` when the target is not used. Latency is a moving average
+    of the successful calls. A target is healthy while its error rate is below
+    `max_healthy_error_rate`.
+
+    Targets are ranked by their expected time to a successful call: the latency
+    divided by the success rate.
+    """
+
+    def __init__(
+        self,
+        targets: Sequence[T],
+        *,
+        half_life_seconds: float = 30.0,
+        smoothing: float = 0.3,
+        max_healthy_error_rate: float = 0.5,
+        clock: Clock | None = None,
+    ) -> None:
+        if not targets:
+            raise ValueError("A target pool needs at least one target")
+
+        self.targets = list(targets)
+        self.half_life_seconds = half_life_seconds
+        self.smoothing = smoothing
+        self.max_healthy_error_rate = max_healthy_error_rate
+        self.clock = MonotonicClock() if clock is None else clock
+        self._lock = threading.Lock()
+        now = self.clock.seconds_since_epoch()
+        self._health = [_TargetHealth(now) for _ in self.targets]
+
+    def _error_rate(self, health: _TargetHealth, now: float) -> float:
+        elapsed = now - health.updated_at
+        return health.error_rate * 0.5 ** (elapsed / self.half_life_seconds)
+
+    def _expected_seconds(self, health: _TargetHealth, now: float) -> float:
+        # Untried targets have a latency of 0, the floor keeps them comparable.
+        success_rate = max(1.0 - self._error_rate(health, now), 1e-3)
+        return (health.latency_seconds + 1e-3) / success_rate
+
+    def error_rate(self, index: int) -> float:
+        with self._lock:
+            return self._error_rate(self._health[index], self.clock.seconds_since_epoch())
+
+    def is_healthy(self, index: int) -> bool:
+        return self.error_rate(index) < self.max_healthy_error_rate
+
+    def choose(self, exclude: frozenset[int] | set[int] = frozenset()) -> int:
+        """
+        Returns the index of the healthiest target that is not excluded, or of the
+        healthiest target overall if all targets are excluded. Ties are broken
+        randomly, to spread load over equally healthy targets.
+        """
+        candidates = [i for i in range(len(self.targets)) if i not in exclude]
+        if not candidates:
+            candidates = list(range(len(self.targets)))
+
+        with self._lock:
+            now = self.clock.seconds_since_epoch()
+            return min(
+                candidates,
+                key=lambda i: (self._expected_seconds(self._health[i], now), random.random()),
+            )
+
+    def record(self, index: int, *, success: bool, latency_seconds: float) -> None:
+        """Record the outcome of a call to the target at `index`."""
+        with self._lock:
+            now = self.clock.seconds_since_epoch()
+            health = self._health[index]
+            error_rate = self._error_rate(health, now)
+            health.error_rate = error_rate + self.smoothing * ((0.0 if success else 1.0) - error_rate)
+            # Failures are often fast, so they would make a broken target look good.
+            if success:
+                health.latency_seconds += self.smoothing * (latency_seconds - health.latency_seconds)
+            health.updated_at = now
+
+
+def retry_with_failover(
+    pool: TargetPool[T],
+    *,
+    retry_on_exceptions: type[Exception] | tuple[type[Exception], ...],
+    max_calls_total: int = 3,
+    retry_window_after_first_call_in_seconds: int = 60,
+    namespace: str | None = None,
+) -> Callable[[Callable[Concatenate[T, P], R]], Callable[P, R]]:
+    """
+    Retry a function like `opnieuw.retry`, passing a target from `pool` as the
+    first argument on every attempt.
+
+    Every attempt goes to the healthiest target that was not tried yet in this
+    call. After a retried exception, the next attempt is made without a backoff if
+    that target is healthy. Otherwise the regular backoff applies, and once all
+    targets have been tried, attempts go to the healthiest target overall.
+
+    Attempts count towards `max_calls_total` whether there was a backoff or not.
+    A retry without a backoff is made as long as the expected duration of an
+    attempt fits in the remaining retry window, and the overload detector, the
+    retry capacity and host-wide backoffs allow it. Otherwise the regular backoff
+    applies.
+
+    This decorator can wrap both sync and async Python functions.
+    """
+
+    if retry_window_after_first_call_in_seconds < 0:
+        warnings.warn(
+            f"`retry_window_after_first_call_in_seconds` must be non-negative, got {retry_window_after_first_call_in_seconds}",
+            UserWarning,
+            stacklevel=2,
+        )
+
+    if max_calls_total < 2:
+        warnings.warn(
+            "`max_calls_total` should at least be 2 for `opnieuw` to retry. "
+            f"It is set to '{max_calls_total}'.",
+            UserWarning,
+            stacklevel=2,
+        )
+
+    def decorator(f: Callable[Concatenate[T, P], R]) -> Callable[P, R]:
+        retried = RetriedFunction(
+            f,
+            retry_on_exceptions=retry_on_exceptions,
+            max_calls_total=max_calls_total,
+            retry_window_after_first_call_in_seconds=retry_window_after_first_call_in_seconds,
+            namespace=namespace,
+        )
+
+        if retried.is_async:
+            async def async_wrapper(*args: P.args, **kwargs: P.kwargs) -> Any:
+                tried: set[int] = set()
+                index = pool.choose()
+                clock, backoff_calculator, call = retried.begin()
+                try:
+                    while True:
+                        tried.add(index)
+                        if call is not None:
+                            call.attempts += 1
+                        attempt_started_at = clock.seconds_since_epoch()
+                        try:
+                            result = await cast("Awaitable[Any]", f(pool.targets[index], *args, **kwargs))
+                        except Exception as e:
+                            if call is None:
+                                call = RetriedCall(retried, clock, backoff_calculator)
+                            if not call.failed(e, attempt_started_at):
+                                raise
+
+                            # Only retried exceptions count against the target, not
+                            # exceptions such as bugs in the caller.
+                            pool.record(
+                                index,
+                                success=False,
+                                latency_seconds=clock.seconds_since_epoch() - attempt_started_at,
+                            )
+                            index = pool.choose(exclude=tried)
+                            if (
+                                index not in tried
+                                and pool.is_healthy(index)
+                                and call.try_immediate_retry()
+                            ):
+                                continue
+
+                            if (sleep_seconds := call.backoff()) is None:
+                                raise
+                            await call.async_sleep(sleep_seconds)
+                        else:
+                            pool.record(
+                                index,
+                                success=True,
+                                latency_seconds=clock.seconds_since_epoch() - attempt_started_at,
+                            )
+                            if call is not None:
+                                call.succeeded()
+                            return result
+                finally:
+                    if call is not None:
+                        call.finish()
+            return cast("Callable[P, R]", functools.wraps(f)(async_wrapper))
+        else:
+            def sync_wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+                tried: set[int] = set()
+                index = pool.choose()
+                clock, backoff_calculator, call = retried.begin()
+                try:
+                    while True:
+                        tried.add(index)
+                        if call is not None:
+                            call.attempts += 1
+                        attempt_started_at = clock.seconds_since_epoch()
+                        try:
+                            result = f(pool.targets[index], *args, **kwargs)
+                        except Exception as e:
+                            if call is None:
+                                call = RetriedCall(retried, clock, backoff_calculator)
+                            if not call.failed(e, attempt_started_at):
+                                raise
+
+                            # Only retried exceptions count against the target, not
+                            # exceptions such as bugs in the caller.
+                            pool.record(
+                                index,
+                                success=False,
+                                latency_seconds=clock.seconds_since_epoch() - attempt_started_at,
+                            )
+                            index = pool.choose(exclude=tried)
+                            if (
+                                index not in tried
+                                and pool.is_healthy(index)
+                                and call.try_immediate_retry()
+                            ):
+                                continue
+
+                            if (sleep_seconds := call.backoff()) is None:
+                                raise
+                            call.sleep(sleep_seconds)
+                        else:
+                            pool.record(
+                                index,
+                                success=True,
+                                latency_seconds=clock.seconds_since_epoch() - attempt_started_at,
+                            )
+                            if call is not None:
+                                call.succeeded()
+                            return result
+                finally:
+                    if call is not None:
+                        call.finish()
+            return functools.wraps(f)(sync_wrapper)
+    return decorator
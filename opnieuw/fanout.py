@@ -0,0 +1,240 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+"""
+Run a function for many items concurrently, with a cap on the concurrency and one
+deadline for all items.
+
+`fan_out` runs a coroutine function, and `fan_out_threads` a regular function in
+a thread pool. Both yield an `ItemResult` per item as soon as the item completes.
+Once the deadline passes, or once `max_failures` items have failed, the remaining
+items are cancelled and yielded with a `FanOutAborted` exception.
+
+The deadline is shared with the `retry` decorators of the calls made for the
+items: a retry is skipped if its backoff would end after the deadline.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import itertools
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Generic, TypeVar
+
+from .retries import _MONOTONIC_CLOCK, _shared_deadline
+
+if TYPE_CHECKING:
+    import asyncio
+
+R = TypeVar("R")
+T = TypeVar("T")
+
+
+class FanOutAborted(Exception):
+    """The item was cancelled or not started, because the fan-out was aborted."""
+
+
+@dataclass(frozen=True)
+class ItemResult(Generic[R]):
+    """
+    The outcome for the item at `index` in the items of a fan-out: its result, or
+    the exception it raised.
+    """
+
+    index: int
+    result: R | None = None
+    exception: BaseException | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.exception is None
+
+
+def _validate(max_concurrency: int, max_failures: int | None) -> None:
+    if max_concurrency < 1:
+        raise ValueError(f"`max_concurrency` must be positive, got {max_concurrency}")
+    if max_failures is not None and max_failures < 1:
+        raise ValueError(f"`max_failures` must be positive, got {max_failures}")
+
+
+def _abort_reason(
+    deadline: float | None, failures: int, max_failures: int | None
+) -> str | None:
+    if max_failures is not None and failures >= max_failures:
+        return f"{failures} items failed"
+    if deadline is not None and _MONOTONIC_CLOCK.seconds_since_epoch() >= deadline:
+        return "the deadline passed"
+    return None
+
+
+def _aborted(index: int, reason: str) -> ItemResult[Any]:
+    return ItemResult(index, exception=FanOutAborted(f"Aborted because {reason}"))
+
+
+def _remaining(deadline: float | None) -> float | None:
+    if deadline is None:
+        return None
+    return max(0.0, deadline - _MONOTONIC_CLOCK.seconds_since_epoch())
+
+
+async def fan_out(
+    func: Callable[[T], Awaitable[R]],
+    items: Iterable[T],
+    *,
+    max_concurrency: int,
+    deadline_seconds: float | None = None,
+    max_failures: int | None = None,
+) -> AsyncIterator[ItemResult[R]]:
+    """
+    Await `func(item)` for every item, at most `max_concurrency` at a time, and
+    yield their outcomes in the order in which they complete.
+
+    Items are started in order. After `deadline_seconds`, or once `max_failures`
+    items raised an exception, the running items are cancelled and the remaining
+    items are not started. The running items are yielded first, followed by the
+    remaining items, which are read from `items` one at a time as they are
+    yielded. Leaving the loop over the results early cancels the running items
+    too.
+    """
+    import asyncio
+
+    _validate(max_concurrency, max_failures)
+    deadline = (
+        None
+        if deadline_seconds is None
+        else _MONOTONIC_CLOCK.seconds_since_epoch() + deadline_seconds
+    )
+
+    async def run(index: int, item: T) -> ItemResult[R]:
+        # Tasks run in a copy of the context, so this only affects this item.
+        _shared_deadline.set(deadline)
+        try:
+            return ItemResult(index, result=await func(item))
+        except Exception as e:
+            return ItemResult(index, exception=e)
+
+    pending_items = enumerate(items)
+    running: dict[asyncio.Task[ItemResult[R]], int] = {}
+    failures = 0
+    try:
+        while True:
+            reason = _abort_reason(deadline, failures, max_failures)
+            if reason is not None:
+                break
+
+            for index, item in itertools.islice(pending_items, max_concurrency - len(running)):
+                running[asyncio.ensure_future(run(index, item))] = index
+            if not running:
+                return
+
+            done, _ = await asyncio.wait(
+                running, timeout=_remaining(deadline), return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                del running[task]
+                item_result = task.result()
+                if not item_result.ok:
+                    failures += 1
+                yield item_result
+
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        stopped = sorted(running.items(), key=lambda task_index: task_index[1])
+        running.clear()
+        for task, index in stopped:
+            # Items that completed before they were cancelled keep their outcome.
+            if task.cancelled():
+                yield _aborted(index, reason)
+            else:
+                yield task.result()
+        # The remaining items are streamed, as `items` may be very long.
+        for index, _ in pending_items:
+            yield _aborted(index, reason)
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+def _run_item(
+    func: Callable[[T], R], index: int, item: T, deadline: float | None
+) -> ItemResult[R]:
+    # Every item runs in its own copy of the context, see `fan_out_threads`.
+    _shared_deadline.set(deadline)
+    try:
+        return ItemResult(index, result=func(item))
+    except Exception as e:
+        return ItemResult(index, exception=e)
+
+
+def fan_out_threads(
+    func: Callable[[T], R],
+    items: Iterable[T],
+    *,
+    max_concurrency: int,
+    deadline_seconds: float | None = None,
+    max_failures: int | None = None,
+) -> Iterator[ItemResult[R]]:
+    """
+    Call `func(item)` for every item in a pool of `max_concurrency` threads, and
+    yield their outcomes in the order in which they complete.
+
+    Like `fan_out`, but threads cannot be cancelled: items that are still running
+    when the fan-out is aborted are yielded as aborted, and their results are
+    discarded. Their retries still stop at the deadline.
+
+    Like `fan_out`, the remaining items are read from `items` one at a time as
+    they are yielded, so `items` may be unbounded.
+    """
+    _validate(max_concurrency, max_failures)
+    deadline = (
+        None
+        if deadline_seconds is None
+        else _MONOTONIC_CLOCK.seconds_since_epoch() + deadline_seconds
+    )
+
+    pending_items = enumerate(items)
+    running: dict[Future[ItemResult[R]], int] = {}
+    failures = 0
+    executor = ThreadPoolExecutor(
+        max_workers=max_concurrency, thread_name_prefix="opnieuw-fan-out"
+    )
+    try:
+        while True:
+            reason = _abort_reason(deadline, failures, max_failures)
+            if reason is not None:
+                break
+
+            for index, item in itertools.islice(pending_items, max_concurrency - len(running)):
+                context = contextvars.copy_context()
+                future = executor.submit(context.run, _run_item, func, index, item, deadline)
+                running[future] = index
+            if not running:
+                return
+
+            done, _ = wait(running, timeout=_remaining(deadline), return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                item_result = future.result()
+                if not item_result.ok:
+                    failures += 1
+                yield item_result
+
+        stopped = sorted(running.items(), key=lambda future_index: future_index[1])
+        for future, index in stopped:
+            if future.done():
+                yield future.result()
+            else:
+                yield _aborted(index, reason)
+        for index, _ in pending_items:
+            yield _aborted(index, reason)
+    finally:
+        for future in running:
+            future.cancel()
+        executor.shutdown(wait=False)
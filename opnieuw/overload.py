@@ -0,0 +1,156 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+"""
+Load shedding of retries when the process itself is overloaded.
+
+When the process is overloaded, retrying only adds more work. With an overload
+detector installed through `set_overload_detector`, `BackoffCalculator` sheds
+retries, or delays them, while the detector reports overload. First attempts are
+never affected.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+
+from . import _hooks
+
+if TYPE_CHECKING:
+    import asyncio
+
+
+class OverloadDetector(ABC):
+    @abstractmethod
+    def is_overloaded(self) -> bool:
+        """Returns whether the process is overloaded. Must be cheap to call."""
+
+
+class EventLoopLagDetector(OverloadDetector):
+    """
+    Detects overload of an asyncio event loop by measuring its lag: how late the
+    loop runs a callback that is scheduled every `interval_seconds`.
+
+    The loop counts as overloaded when the exponential moving average of the lag
+    exceeds `max_lag_seconds`. Call `start` from within the running loop.
+    """
+
+    def __init__(
+        self,
+        *,
+        interval_seconds: float = 0.1,
+        max_lag_seconds: float = 0.1,
+        smoothing: float = 0.3,
+    ) -> None:
+        self.interval_seconds = interval_seconds
+        self.max_lag_seconds = max_lag_seconds
+        self.smoothing = smoothing
+        self.lag_seconds = 0.0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._handle: asyncio.TimerHandle | None = None
+        self._expected_at = 0.0
+
+    def start(self) -> None:
+        import asyncio
+
+        self._loop = asyncio.get_running_loop()
+        self._schedule()
+
+    def stop(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _schedule(self) -> None:
+        assert self._loop is not None
+        self._expected_at = self._loop.time() + self.interval_seconds
+        self._handle = self._loop.call_at(self._expected_at, self._probe)
+
+    def _probe(self) -> None:
+        assert self._loop is not None
+        lag_seconds = max(0.0, self._loop.time() - self._expected_at)
+        self.lag_seconds += self.smoothing * (lag_seconds - self.lag_seconds)
+        self._schedule()
+
+    def is_overloaded(self) -> bool:
+        return self.lag_seconds > self.max_lag_seconds
+
+
+class CpuPressureDetector(OverloadDetector):
+    """
+    Detects overload of a threaded process by looking at CPU pressure.
+
+    The process counts as overloaded when the run queue of the host, as measured
+    by the 1-minute load average per core, exceeds `max_load_per_core`, or when the
+    CPU time used by the process itself since the previous sample, per core,
+    exceeds `max_process_cpu_per_core`. Samples are taken at most every
+    `sample_interval_seconds`, by whichever thread asks first.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_load_per_core: float = 2.0,
+        max_process_cpu_per_core: float = 0.9,
+        sample_interval_seconds: float = 1.0,
+    ) -> None:
+        self.max_load_per_core = max_load_per_core
+        self.max_process_cpu_per_core = max_process_cpu_per_core
+        self.sample_interval_seconds = sample_interval_seconds
+        self._cores = os.cpu_count() or 1
+        self._lock = threading.Lock()
+        self._sampled_at = time.monotonic()
+        self._process_time = time.process_time()
+        self._overloaded = False
+
+    def _sample(self) -> None:
+        now = time.monotonic()
+        if now <= self._sampled_at:
+            return
+        process_time = time.process_time()
+        process_cpu_per_core = (process_time - self._process_time) / (
+            (now - self._sampled_at) * self._cores
+        )
+        self._sampled_at = now
+        self._process_time = process_time
+
+        try:
+            load_per_core = os.getloadavg()[0] / self._cores
+        except (AttributeError, OSError):
+            # The load average is not available on all platforms.
+            load_per_core = 0.0
+
+        self._overloaded = (
+            load_per_core > self.max_load_per_core
+            or process_cpu_per_core > self.max_process_cpu_per_core
+        )
+
+    def is_overloaded(self) -> bool:
+        if time.monotonic() - self._sampled_at >= self.sample_interval_seconds:
+            # If another thread is sampling already, use the previous sample.
+            if self._lock.acquire(blocking=False):
+                try:
+                    self._sample()
+                finally:
+                    self._lock.release()
+        return self._overloaded
+
+
+def set_overload_detector(
+    detector: OverloadDetector | None, *, delay_factor: float | None = None
+) -> None:
+    """
+    Skip retries while the given detector reports overload. If `delay_factor` is
+    given, retries are not skipped but their backoff is multiplied by it instead.
+    Retries that no longer fit the retry window after the delay are skipped.
+
+    None disables load shedding again.
+    """
+    _hooks.overload_detector = detector
+    _hooks.overload_delay_factor = delay_factor
@@ -0,0 +1,179 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+"""
+Retry policies per namespace, configured in a TOML file.
+
+A policy file defines named policies, which apply to the `retry` decorators with
+the same `namespace`:
+
+    [policies.payments]
+    max_calls_total = 5
+    retry_window_after_first_call_in_seconds = 30
+
+A policy takes precedence over the values passed to the decorator, so retry
+behavior can be changed without a code change. `PolicyFile` reloads the file when
+it changes. A file is parsed and validated as a whole before any of its policies
+are applied, so a broken file never leaves the policies half-updated.
+
+Reading TOML requires Python 3.11 or newer, or the `tomli` package.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sys
+import threading
+import warnings
+from collections.abc import Mapping
+from typing import Any, NamedTuple
+
+from .retries import set_policies
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy(NamedTuple):
+    max_calls_total: int
+    retry_window_after_first_call_in_seconds: int
+
+    @classmethod
+    def from_mapping(cls, name: str, values: Mapping[str, Any]) -> RetryPolicy:
+        unknown = set(values) - set(cls._fields)
+        if unknown:
+            raise ValueError(f"Policy {name!r} has unknown settings: {sorted(unknown)}")
+
+        missing = set(cls._fields) - set(values)
+        if missing:
+            raise ValueError(f"Policy {name!r} is missing settings: {sorted(missing)}")
+
+        for field in cls._fields:
+            if not isinstance(values[field], int) or isinstance(values[field], bool):
+                raise ValueError(f"Policy {name!r}: `{field}` must be an integer")
+
+        if values["retry_window_after_first_call_in_seconds"] < 0:
+            raise ValueError(
+                f"Policy {name!r}: `retry_window_after_first_call_in_seconds` must be non-negative"
+            )
+
+        if values["max_calls_total"] < 2:
+            warnings.warn(
+                f"Policy {name!r}: `max_calls_total` should at least be 2 for `opnieuw` to retry.",
+                UserWarning,
+                stacklevel=2,
+            )
+
+        return cls(**values)
+
+
+def parse_policies(data: bytes) -> dict[str, RetryPolicy]:
+    """Parse the policies in the contents of a policy file."""
+    if sys.version_info >= (3, 11):
+        import tomllib
+    else:
+        import tomli as tomllib
+
+    document = tomllib.loads(data.decode("utf-8"))
+    policies = document.get("policies", {})
+    if not isinstance(policies, dict):
+        raise ValueError("`policies` must be a table")
+
+    result = {}
+    for name, values in policies.items():
+        if not isinstance(values, dict):
+            raise ValueError(f"Policy {name!r} must be a table")
+        result[name] = RetryPolicy.from_mapping(name, values)
+    return result
+
+
+class PolicyFile:
+    """
+    Applies the policies in the TOML file at `path`, and with `start`, keeps them
+    up to date when the file changes.
+
+    The file is checked for changes every `poll_interval_seconds` by a background
+    thread. If a changed file cannot be loaded, the previous policies stay in place
+    and a warning is logged.
+    """
+
+    def __init__(
+        self, path: str | os.PathLike[str], *, poll_interval_seconds: float = 1.0
+    ) -> None:
+        self.path = os.fspath(path)
+        self.poll_interval_seconds = poll_interval_seconds
+        self.policies: Mapping[str, RetryPolicy] = {}
+        self._version: tuple[int, int] | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def load(self) -> None:
+        """Load and apply the policies in the file. Raises if the file is invalid."""
+        with self._lock:
+            self._load()
+
+    def _load(self) -> None:
+        # Callers must hold `self._lock`.
+        stat = os.stat(self.path)
+        with open(self.path, "rb") as f:
+            policies = parse_policies(f.read())
+        set_policies(policies)
+        self.policies = policies
+        self._version = (stat.st_mtime_ns, stat.st_size)
+
+    def reload_if_changed(self) -> bool:
+        """
+        Load the file if it changed since it was last loaded. Returns whether the
+        policies were reloaded.
+        """
+        # Check and load under one lock, so that concurrent reloads cannot apply
+        # an older version of the file after a newer one.
+        with self._lock:
+            return self._reload_if_changed()
+
+    def _reload_if_changed(self) -> bool:
+        try:
+            stat = os.stat(self.path)
+        except OSError as e:
+            if self._version is not None:
+                self._version = None
+                logger.warning(f"Could not read retry policies, keeping the previous ones: {e}")
+            return False
+
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version == self._version:
+            return False
+
+        try:
+            self._load()
+        except Exception as e:
+            # Don't try again until the file changes again.
+            self._version = version
+            logger.warning(
+                f"Could not load retry policies from {self.path}, keeping the previous ones: {e}"
+            )
+            return False
+        return True
+
+    def start(self) -> None:
+        """Load the file, and keep reloading it in a background thread when it changes."""
+        self.load()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="opnieuw-policy-reloader", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop watching the file. The policies stay in place."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.poll_interval_seconds):
+            self.reload_if_changed()
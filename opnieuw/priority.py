@@ -0,0 +1,156 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+"""
+Priority classes that share the retry capacity of a namespace.
+
+By default every retry competes equally. Once a namespace has a `RetryCapacity`,
+its retries draw from a shared token bucket, and lower priority classes are held
+to a reserve: they are shed while the bucket is running low, leaving the remaining
+retries to higher priority calls. Lower priority classes also back off longer.
+
+The priority of a call is taken from `with_priority` if it is used, and from the
+`priority` argument of the `retry` decorator otherwise.
+"""
+
+from __future__ import annotations
+
+import enum
+import threading
+from collections.abc import Iterator, Mapping
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from .clock import Clock, MonotonicClock
+
+
+class Priority(enum.IntEnum):
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+DEFAULT_RESERVED_FRACTIONS: Mapping[Priority, float] = {
+    Priority.HIGH: 0.0,
+    Priority.NORMAL: 0.25,
+    Priority.LOW: 0.5,
+}
+
+DEFAULT_BACKOFF_FACTORS: Mapping[Priority, float] = {
+    Priority.HIGH: 1.0,
+    Priority.NORMAL: 1.0,
+    Priority.LOW: 2.0,
+}
+
+
+class RetryCapacity:
+    """
+    A token bucket of retries, refilled at `retries_per_second` up to `burst`.
+
+    A retry of a given priority only gets a token if the bucket keeps at least its
+    reserved fraction of `burst` afterwards, so low priority retries are shed first
+    when the bucket drains. Backoffs of a priority are multiplied by its backoff
+    factor.
+    """
+
+    def __init__(
+        self,
+        *,
+        retries_per_second: float,
+        burst: int,
+        reserved_fractions: Mapping[Priority, float] = DEFAULT_RESERVED_FRACTIONS,
+        backoff_factors: Mapping[Priority, float] = DEFAULT_BACKOFF_FACTORS,
+        clock: Clock | None = None,
+    ) -> None:
+        self.retries_per_second = retries_per_second
+        self.burst = burst
+        self.reserved_tokens = {
+            priority: reserved_fractions[priority] * burst for priority in Priority
+        }
+        self.backoff_factors = {
+            priority: backoff_factors[priority] for priority in Priority
+        }
+        self.clock = MonotonicClock() if clock is None else clock
+        self._lock = threading.Lock()
+        self._tokens = float(burst)
+        self._refilled_at = self.clock.seconds_since_epoch()
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def _refill(self) -> None:
+        now = self.clock.seconds_since_epoch()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._refilled_at) * self.retries_per_second
+        )
+        self._refilled_at = now
+
+    def try_acquire(self, priority: Priority) -> bool:
+        """Take a token for a retry of the given priority, if there is one left."""
+        with self._lock:
+            self._refill()
+            if self._tokens - 1 < self.reserved_tokens[priority]:
+                return False
+            self._tokens -= 1
+            return True
+
+    def backoff_factor(self, priority: Priority) -> float:
+        return self.backoff_factors[priority]
+
+
+# Like the namespace registry in `opnieuw.retries`, this dict is copy-on-write.
+_capacities: dict[str | None, RetryCapacity] = {}
+_capacities_lock = threading.Lock()
+
+
+def set_retry_capacity(
+    capacity: RetryCapacity | None, *, namespace: str | None = None
+) -> None:
+    """
+    Make all retries in the given namespace share the given capacity. None makes
+    the retries of the namespace unlimited again.
+    """
+    global _capacities
+    with _capacities_lock:
+        capacities = dict(_capacities)
+        if capacity is None:
+            capacities.pop(namespace, None)
+        else:
+            capacities[namespace] = capacity
+        _capacities = capacities
+
+
+def get_retry_capacity(namespace: str | None) -> RetryCapacity | None:
+    return _capacities.get(namespace)
+
+
+_current_priority: ContextVar[Priority | None] = ContextVar(
+    "opnieuw_priority", default=None
+)
+
+
+def get_priority(default: Priority = Priority.NORMAL) -> Priority:
+    """Returns the priority set with `with_priority`, or `default` if there is none."""
+    priority = _current_priority.get()
+    return default if priority is None else priority
+
+
+@contextmanager
+def with_priority(priority: Priority) -> Iterator[None]:
+    """
+    A context manager that sets the priority of all retried calls made within it,
+    overriding the `priority` argument of the `retry` decorator.
+
+    Like `opnieuw.retries.replace_backoff_calculator`, the priority is
+    context-local.
+    """
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
@@ -0,0 +1,245 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+"""
+Accounting of the time spent in backoffs, per decorated function.
+
+The profiler is disabled by default. Once enabled with `enable_profiler`, every
+call of a `retry` decorated function records how many attempts it took, how long
+it slept in backoffs and how it ended. The counters live in preallocated arrays,
+so recording a call does not allocate and the profiler is cheap enough to keep
+enabled in production.
+"""
+
+from __future__ import annotations
+
+import itertools
+import os
+import threading
+from array import array
+from dataclasses import dataclass
+from typing import IO
+
+from . import _hooks
+from ._hooks import FAILED, GAVE_UP, SUCCEEDED
+
+# Indices into the integer counters of a call site.
+_CALLS = 0
+_ATTEMPTS = 1
+_SUCCESSES = 2
+_GIVE_UPS = 3
+_NUM_COUNTS = 4
+
+# Indices into the floating point counters of a call site.
+_BACKOFF_SECONDS = 0
+_SUCCESS_SECONDS = 1
+_NUM_SECONDS = 2
+
+OVERFLOW_NAME = "<other>"
+
+
+@dataclass(frozen=True)
+class CallSiteStats:
+    """A snapshot of the counters of a single call site."""
+
+    name: str
+    namespace: str | None
+    calls: int
+    attempts: int
+    successes: int
+    give_ups: int
+    backoff_seconds: float
+    success_seconds: float
+
+    @property
+    def mean_time_to_success_seconds(self) -> float | None:
+        if self.successes == 0:
+            return None
+        return self.success_seconds / self.successes
+
+
+class _Shard:
+    """Counters for all call sites, updated by a subset of the threads."""
+
+    __slots__ = ("lock", "counts", "seconds")
+
+    def __init__(self, num_slots: int) -> None:
+        self.lock = threading.Lock()
+        self.counts = array("q", bytes(8 * _NUM_COUNTS * num_slots))
+        self.seconds = array("d", bytes(8 * _NUM_SECONDS * num_slots))
+
+
+class RetryProfiler:
+    """
+    Keeps track of the backoff time, attempts, give-ups and time to success per
+    call site.
+
+    Counters are preallocated for `max_call_sites` call sites. Any call sites beyond
+    that are accounted for together under the name `<other>`, so the memory use of
+    the profiler is fixed.
+
+    The counters are split into `shards` independently locked copies, and every
+    thread only ever updates one of them. This keeps threads from contending on a
+    single lock when the GIL is disabled. Snapshots sum the shards.
+    """
+
+    def __init__(self, max_call_sites: int = 1024, shards: int | None = None) -> None:
+        if max_call_sites < 1:
+            raise ValueError(f"`max_call_sites` must be positive, got {max_call_sites}")
+        if shards is None:
+            shards = min(os.cpu_count() or 1, 8)
+        if shards < 1:
+            raise ValueError(f"`shards` must be positive, got {shards}")
+
+        # The last slot is reserved for the call sites that did not fit.
+        self.max_call_sites = max_call_sites
+        self._shards = [_Shard(max_call_sites + 1) for _ in range(shards)]
+        self._next_shard = itertools.count()
+        self._thread_shard = threading.local()
+        # Like the namespace registry in `opnieuw.retries`, the slots dict is
+        # copy-on-write, so looking up a known call site does not take a lock.
+        self._slots: dict[tuple[str, str | None], int] = {}
+        self._slots_lock = threading.Lock()
+
+    def _slot(self, call_site: tuple[str, str | None]) -> int:
+        slot = self._slots.get(call_site)
+        if slot is not None:
+            return slot
+
+        with self._slots_lock:
+            slot = self._slots.get(call_site)
+            if slot is None:
+                if len(self._slots) >= self.max_call_sites:
+                    return self.max_call_sites
+                slot = len(self._slots)
+                slots = dict(self._slots)
+                slots[call_site] = slot
+                self._slots = slots
+            return slot
+
+    def _shard(self) -> _Shard:
+        try:
+            return self._thread_shard.shard
+        except AttributeError:
+            shard = self._shards[next(self._next_shard) % len(self._shards)]
+            self._thread_shard.shard = shard
+            return shard
+
+    def record(
+        self,
+        call_site: tuple[str, str | None],
+        outcome: int,
+        attempts: int,
+        backoff_seconds: float,
+        elapsed_seconds: float,
+    ) -> None:
+        """
+        Record a single call of a decorated function.
+
+        The retry decorators call this once per call, after the last attempt.
+        """
+        slot = self._slot(call_site)
+        counts = slot * _NUM_COUNTS
+        seconds = slot * _NUM_SECONDS
+        shard = self._shard()
+        with shard.lock:
+            shard.counts[counts + _CALLS] += 1
+            shard.counts[counts + _ATTEMPTS] += attempts
+            shard.seconds[seconds + _BACKOFF_SECONDS] += backoff_seconds
+            if outcome == SUCCEEDED:
+                shard.counts[counts + _SUCCESSES] += 1
+                shard.seconds[seconds + _SUCCESS_SECONDS] += elapsed_seconds
+            elif outcome == GAVE_UP:
+                shard.counts[counts + _GIVE_UPS] += 1
+
+    def reset(self) -> None:
+        """Forget all recorded calls."""
+        with self._slots_lock:
+            self._slots = {}
+            for shard in self._shards:
+                with shard.lock:
+                    for i in range(len(shard.counts)):
+                        shard.counts[i] = 0
+                    for i in range(len(shard.seconds)):
+                        shard.seconds[i] = 0.0
+
+    def stats(self) -> list[CallSiteStats]:
+        """Return a snapshot of the counters, sorted by descending backoff time."""
+        slots = list(self._slots.items())
+        slots.append(((OVERFLOW_NAME, None), self.max_call_sites))
+
+        counts = array("q", bytes(8 * len(self._shards[0].counts)))
+        seconds = array("d", bytes(8 * len(self._shards[0].seconds)))
+        for shard in self._shards:
+            with shard.lock:
+                for i, value in enumerate(shard.counts):
+                    counts[i] += value
+                for i, value in enumerate(shard.seconds):
+                    seconds[i] += value
+
+        result = []
+        for (name, namespace), slot in slots:
+            c = slot * _NUM_COUNTS
+            s = slot * _NUM_SECONDS
+            if counts[c + _CALLS] == 0:
+                continue
+            result.append(
+                CallSiteStats(
+                    name=name,
+                    namespace=namespace,
+                    calls=counts[c + _CALLS],
+                    attempts=counts[c + _ATTEMPTS],
+                    successes=counts[c + _SUCCESSES],
+                    give_ups=counts[c + _GIVE_UPS],
+                    backoff_seconds=seconds[s + _BACKOFF_SECONDS],
+                    success_seconds=seconds[s + _SUCCESS_SECONDS],
+                )
+            )
+        result.sort(key=lambda stats: stats.backoff_seconds, reverse=True)
+        return result
+
+    def report(self) -> str:
+        """Return a human readable table of the counters."""
+        lines = [
+            f"{'backoff (s)':>12} {'calls':>8} {'attempts':>9} {'give-ups':>9} "
+            f"{'mean success (s)':>17}  call site"
+        ]
+        for stats in self.stats():
+            mean = stats.mean_time_to_success_seconds
+            mean_str = "-" if mean is None else f"{mean:.3f}"
+            namespace = "" if stats.namespace is None else f" [{stats.namespace}]"
+            lines.append(
+                f"{stats.backoff_seconds:>12.3f} {stats.calls:>8} {stats.attempts:>9} "
+                f"{stats.give_ups:>9} {mean_str:>17}  {stats.name}{namespace}"
+            )
+        return "\n".join(lines)
+
+    def write_collapsed(self, out: IO[str]) -> None:
+        """
+        Write the backoff time per call site in the collapsed stack format used by
+        flamegraph tools, with one line per call site and the backoff time in
+        milliseconds as the sample count.
+        """
+        for stats in self.stats():
+            namespace = "<default>" if stats.namespace is None else stats.namespace
+            frames = [namespace, *stats.name.split(".")]
+            value = round(stats.backoff_seconds * 1000)
+            out.write(f"opnieuw;{';'.join(frames)} {value}\n")
+
+
+def enable_profiler(profiler: RetryProfiler | None = None) -> RetryProfiler:
+    """
+    Start recording all calls of `retry` decorated functions into the given
+    profiler, or a new one if no profiler is given. Returns the profiler.
+    """
+    if profiler is None:
+        profiler = RetryProfiler()
+    _hooks.profiler = profiler
+    return profiler
+
+
+def disable_profiler() -> None:
+    """Stop recording calls of `retry` decorated functions."""
+    _hooks.profiler = None
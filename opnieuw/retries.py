@@ -7,32 +7,85 @@
 
 from __future__ import annotations
 
-import asyncio
 import functools
-import inspect
-import logging
 import random
 import sys
-import time
-import typing_extensions
+import threading
 import warnings
-from collections import defaultdict
-from collections.abc import Callable, Iterator
+from collections.abc import Callable, Iterator, Mapping
 from contextlib import contextmanager
 from contextvars import ContextVar
-from typing import TypeVar, Awaitable, cast, overload
+from typing import TYPE_CHECKING, Any, TypeVar, cast, overload
 
-if sys.version_info < (3, 10):
-    from typing_extensions import ParamSpec
+from . import _hooks
+from . import priority as _priority
+from .clock import Clock, MonotonicClock
+from .priority import Priority
+
+# Imports that are only needed for type checking, or only once something is
+# retried, are deferred so that `import opnieuw` stays cheap for short-lived
+# processes. `benchmarks/bench_import_time.py` keeps track of this.
+if TYPE_CHECKING:
+    import logging
+    from collections.abc import Awaitable
+
+    from typing_extensions import deprecated
+
+    from .cache import ResultCache
+    from .policy import RetryPolicy
+    from .profiler import RetryProfiler
+
+    if sys.version_info < (3, 10):
+        from typing_extensions import ParamSpec
+    else:
+        from typing import ParamSpec
+
+    P = ParamSpec("P")
 else:
-    from typing import ParamSpec
 
-from .clock import Clock, MonotonicClock
+    def deprecated(message: str, *, category: None) -> Callable[[R], R]:
+        # At runtime, `typing_extensions.deprecated` with `category=None` only
+        # sets `__deprecated__`, so we avoid importing `typing_extensions` for it.
+        def decorator(f: R) -> R:
+            f.__deprecated__ = message
+            return f
+
+        return decorator
 
-logger = logging.getLogger(__name__)
 
 R = TypeVar("R")
-P = ParamSpec("P")
+
+
+@functools.lru_cache(maxsize=None)
+def _get_logger() -> logging.Logger:
+    import logging
+
+    return logging.getLogger(__name__)
+
+
+def __getattr__(name: str) -> Any:
+    # `logger` used to be a module attribute, keep it available.
+    if name == "logger":
+        return _get_logger()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# The value of `inspect.CO_COROUTINE`.
+_CO_COROUTINE = 0x80
+
+
+def _is_coroutine_function(f: Callable[..., Any]) -> bool:
+    """
+    Equivalent to `inspect.iscoroutinefunction`, without importing `inspect` for
+    the common case of a plain function.
+    """
+    code = getattr(f, "__code__", None)
+    if code is not None and not hasattr(f, "_is_coroutine_marker"):
+        return bool(code.co_flags & _CO_COROUTINE)
+
+    import inspect
+
+    return inspect.iscoroutinefunction(f)
 
 
 def calculate_exponential_multiplier(
@@ -78,13 +131,21 @@ class BackoffCalculator:
     Will consider the maximum amount of backoffs and a maximum backoff window.
     """
 
+    # The expected duration of the next attempt, if known. The retry decorators
+    # keep it up to date, see `_AttemptDurations`.
+    expected_attempt_seconds: float | None = None
+
     def __init__(
         self,
         clock: Clock,
         max_calls_total: int,
         retry_window_after_first_call_in_seconds: int,
+        namespace: str | None = None,
+        priority: Priority = Priority.NORMAL,
     ) -> None:
         self.clock = clock
+        self.namespace = namespace
+        self.priority = priority
         self.max_calls_total = max_calls_total
         self.deadline_second = (
             self.clock.seconds_since_epoch() + retry_window_after_first_call_in_seconds
@@ -106,32 +167,224 @@ class BackoffCalculator:
 
         self.backoffs += 1
         if self.backoffs >= self.max_calls_total:
-            logger.debug(f"Used up all {self.backoffs} retries.")
+            _get_logger().debug(f"Used up all {self.backoffs} retries.")
             return None
 
-        remaining_window = self.deadline_second - self.clock.seconds_since_epoch()
+        capacity = _priority.get_retry_capacity(self.namespace)
+        if capacity is not None:
+            jittered_backoff *= capacity.backoff_factor(self.priority)
+
+        detector = _hooks.overload_detector
+        if detector is not None and detector.is_overloaded():
+            delay_factor = _hooks.overload_delay_factor
+            if delay_factor is None:
+                _get_logger().debug("Process is overloaded, not retrying.")
+                return None
+            jittered_backoff *= delay_factor
+
+        coordinator = _hooks.coordinator
+        if coordinator is not None:
+            host_backoff = coordinator.remaining_backoff(self.namespace)
+            if host_backoff > jittered_backoff:
+                # Add jitter on top, so that all processes on the host don't retry
+                # at the exact moment that the host-wide backoff ends.
+                jittered_backoff = host_backoff + random.uniform(0.0, self.base_in_seconds)
+
+        remaining_window = self._remaining_window()
         if jittered_backoff > remaining_window:
-            logger.debug(
+            _get_logger().debug(
                 f"Next attempt would be after retry deadline (remaining window: {remaining_window:.3f}s), not retrying."
             )
             return None
 
-        logger.debug(
+        expected_attempt_seconds = self.expected_attempt_seconds
+        if (
+            expected_attempt_seconds is not None
+            and jittered_backoff + expected_attempt_seconds > remaining_window
+        ):
+            _get_logger().debug(
+                f"Next attempt would end after retry deadline (expected attempt duration: "
+                f"{expected_attempt_seconds:.3f}s, remaining window: {remaining_window:.3f}s), not retrying."
+            )
+            return None
+
+        if capacity is not None and not capacity.try_acquire(self.priority):
+            _get_logger().debug(
+                f"No retry capacity left for priority {self.priority.name}, not retrying."
+            )
+            return None
+
+        _get_logger().debug(
             f"Backoff for {jittered_backoff:.3f} seconds after attempt {self.backoffs}/{self.max_calls_total} "
             f"(remaining window: {remaining_window:.3f}s)"
         )
         return jittered_backoff
 
+    def try_immediate_retry(self) -> bool:
+        """
+        Return whether a retry can be made right away, without a backoff, such as
+        on another target in `opnieuw.failover`. If so, it counts as a retry.
+
+        Like `get_backoff`, this considers the number of calls, the remaining
+        window, overload, the retry capacity and host-wide backoffs. No retry is
+        made right away while the process is overloaded or a host-wide backoff
+        applies. The caller should then fall back to `get_backoff`, which decides
+        whether to retry after a backoff.
+        """
+        if self.backoffs + 1 >= self.max_calls_total:
+            return False
+
+        remaining_window = self._remaining_window()
+        expected_attempt_seconds = self.expected_attempt_seconds or 0.0
+        if remaining_window <= 0 or expected_attempt_seconds > remaining_window:
+            return False
+
+        detector = _hooks.overload_detector
+        if detector is not None and detector.is_overloaded():
+            return False
 
-__backoff_namespaces: dict[
-    str | None, ContextVar[type[BackoffCalculator]]
-] = defaultdict(
-    lambda: ContextVar("opnieuw_default_backoff_state", default=BackoffCalculator)
+        coordinator = _hooks.coordinator
+        if coordinator is not None and coordinator.remaining_backoff(self.namespace) > 0:
+            return False
+
+        capacity = _priority.get_retry_capacity(self.namespace)
+        if capacity is not None and not capacity.try_acquire(self.priority):
+            return False
+
+        self.backoffs += 1
+        _get_logger().debug(
+            f"Retry without backoff after attempt {self.backoffs}/{self.max_calls_total} "
+            f"(remaining window: {remaining_window:.3f}s)"
+        )
+        return True
+
+    def _remaining_window(self) -> float:
+        remaining_window = self.deadline_second - self.clock.seconds_since_epoch()
+        shared_deadline = _shared_deadline.get()
+        if shared_deadline is not None:
+            remaining_window = min(
+                remaining_window, shared_deadline - _MONOTONIC_CLOCK.seconds_since_epoch()
+            )
+        return remaining_window
+
+
+_MONOTONIC_CLOCK = MonotonicClock()
+
+# A deadline on the monotonic clock that is shared by a group of calls, such as the
+# items of a fan-out in `opnieuw.fanout`. Retries never go past it, whatever their
+# own retry window is.
+_shared_deadline: ContextVar[float | None] = ContextVar(
+    "opnieuw_shared_deadline", default=None
 )
 
 
-def _get_backoff_calculator_class(namespace: str | None) -> type[BackoffCalculator]:
-    return __backoff_namespaces[namespace].get()
+class _AttemptDurations:
+    """
+    Exponential moving average of the duration of the attempts of a decorated
+    function that were followed by a retry decision.
+
+    Successful attempts are not recorded, so that the common case of a call that
+    succeeds right away does not write to state that is shared between threads.
+    Only attempts timed with the real monotonic clock are recorded, so virtual time
+    in tests does not leak into the average.
+
+    Updates are not locked. Concurrent updates may overwrite each other, which only
+    loses a sample.
+    """
+
+    __slots__ = ("mean_seconds",)
+
+    SMOOTHING = 0.2
+
+    def __init__(self) -> None:
+        self.mean_seconds: float | None = None
+
+    def add(self, seconds: float) -> None:
+        mean_seconds = self.mean_seconds
+        if mean_seconds is None:
+            self.mean_seconds = seconds
+        else:
+            self.mean_seconds = mean_seconds + self.SMOOTHING * (seconds - mean_seconds)
+
+
+class _Namespace:
+    """
+    The retry state of a single namespace.
+
+    The backoff calculator and the clock are context-local.
+    """
+
+    __slots__ = ("backoff_calculator", "clock")
+
+    def __init__(self) -> None:
+        self.backoff_calculator: ContextVar[type[BackoffCalculator]] = ContextVar(
+            "opnieuw_default_backoff_state", default=BackoffCalculator
+        )
+        self.clock: ContextVar[Clock] = ContextVar(
+            "opnieuw_default_clock", default=_MONOTONIC_CLOCK
+        )
+
+
+# The namespace registry is copy-on-write: registering a namespace replaces the
+# dict as a whole, and the dict is never mutated once it is published. Lookups
+# therefore never need the lock, also on free-threaded Python builds. Decorators
+# look up their namespace once when they are applied, so calls of decorated
+# functions do not touch the registry at all.
+__namespaces: dict[str | None, _Namespace] = {None: _Namespace()}
+__namespaces_lock = threading.Lock()
+# Like the namespace registry, the policies are replaced as a whole and never
+# mutated, so every call sees either all old or all new policies.
+__policies: Mapping[str, RetryPolicy] = {}
+
+
+def _get_namespace(namespace: str | None) -> _Namespace:
+    state = __namespaces.get(namespace)
+    if state is None:
+        state = _register_namespace(namespace)
+    return state
+
+
+def _register_namespace(namespace: str | None) -> _Namespace:
+    global __namespaces
+    with __namespaces_lock:
+        state = __namespaces.get(namespace)
+        if state is None:
+            state = _Namespace()
+            namespaces = dict(__namespaces)
+            namespaces[namespace] = state
+            __namespaces = namespaces
+        return state
+
+
+def register_namespace(namespace: str) -> None:
+    """
+    Register a namespace up front.
+
+    Namespaces are registered automatically the first time they are used, so
+    calling this is never required. It can be used to set up all namespaces at
+    startup, before any threads are started.
+    """
+    _register_namespace(namespace)
+
+
+def set_policies(policies: Mapping[str, RetryPolicy]) -> None:
+    """
+    Replace the retry policies of all namespaces.
+
+    A namespace with a policy uses the `max_calls_total` and
+    `retry_window_after_first_call_in_seconds` of the policy instead of those
+    passed to its decorators. See `opnieuw.policy` for loading policies from a
+    file.
+
+    The policies of all namespaces are replaced at once. Every call reads the
+    policy of its namespace once, when it starts.
+    """
+    global __policies
+    __policies = dict(policies)
+
+
+def _get_policy(namespace: str | None) -> RetryPolicy | None:
+    return None if namespace is None else __policies.get(namespace)
 
 
 @contextmanager
@@ -148,11 +401,223 @@ def replace_backoff_calculator(
     in a thread or asyncio task will not bleed to other threads or asyncio tasks.
     See https://docs.python.org/3/library/contextvars.html for more details.
     """
-    token = __backoff_namespaces[namespace].set(state)
+    backoff_calculator = _get_namespace(namespace).backoff_calculator
+    token = backoff_calculator.set(state)
+    try:
+        yield
+    finally:
+        backoff_calculator.reset(token)
+
+
+@contextmanager
+def replace_clock(clock: Clock, *, namespace: str | None = None) -> Iterator[None]:
+    """
+    A context manager that replaces the clock of the specified namespace with the
+    given `Clock`.
+
+    The clock is used both to keep track of the retry window and to sleep between
+    attempts. Replacing it with a `DummyClock` makes the retry decorators run in
+    virtual time (see `opnieuw.test_util.virtual_time`).
+
+    Like `replace_backoff_calculator`, the clock is context-local.
+    """
+    namespace_clock = _get_namespace(namespace).clock
+    token = namespace_clock.set(clock)
     try:
         yield
     finally:
-        __backoff_namespaces[namespace].reset(token)
+        namespace_clock.reset(token)
+
+
+def _qualified_name(f: Callable[..., Any]) -> str:
+    """Returns the name of a decorated function, as reported by the profiler."""
+    while isinstance(f, functools.partial):
+        f = f.func
+    # Callable objects have no `__qualname__`, they are named after their class.
+    if not hasattr(f, "__qualname__"):
+        f = type(f)
+    module = getattr(f, "__module__", None)
+    return f.__qualname__ if module is None else f"{module}.{f.__qualname__}"
+
+
+class RetriedFunction:
+    """
+    The settings and state of a function decorated with `retry`, which are shared
+    by all its calls.
+
+    Together with `RetriedCall`, this does the bookkeeping of the retry decorators:
+    the backoff calculator, the retry policy, attempt durations, the coordinator
+    and the profiler. Decorators that build on `retry`, such as
+    `opnieuw.failover.retry_with_failover`, use them to behave the same.
+    """
+
+    __slots__ = (
+        "is_async",
+        "retry_on_exceptions",
+        "max_calls_total",
+        "retry_window_after_first_call_in_seconds",
+        "namespace",
+        "priority",
+        "call_site",
+        "attempt_durations",
+        "_namespace_state",
+    )
+
+    def __init__(
+        self,
+        f: Callable[..., Any],
+        *,
+        retry_on_exceptions: type[Exception] | tuple[type[Exception], ...],
+        max_calls_total: int,
+        retry_window_after_first_call_in_seconds: int,
+        namespace: str | None = None,
+        priority: Priority = Priority.NORMAL,
+    ) -> None:
+        self.is_async = _is_coroutine_function(f)
+        self.retry_on_exceptions = retry_on_exceptions
+        self.max_calls_total = max_calls_total
+        self.retry_window_after_first_call_in_seconds = retry_window_after_first_call_in_seconds
+        self.namespace = namespace
+        self.priority = priority
+        self.call_site = (_qualified_name(f), namespace)
+        self.attempt_durations = _AttemptDurations()
+        self._namespace_state = _get_namespace(namespace)
+
+    def begin(self) -> tuple[Clock, BackoffCalculator, RetriedCall | None]:
+        """
+        Start a call. Returns the clock and a new backoff calculator for the call,
+        and a `RetriedCall` if the profiler is enabled.
+
+        Without the profiler, the `RetriedCall` is only created once an attempt
+        needs a retry decision, so that calls that succeed right away stay cheap.
+        """
+        namespace_state = self._namespace_state
+        clock = namespace_state.clock.get()
+        policy = _get_policy(self.namespace)
+        backoff_calculator = namespace_state.backoff_calculator.get()(
+            clock,
+            max_calls_total=self.max_calls_total if policy is None else policy.max_calls_total,
+            retry_window_after_first_call_in_seconds=(
+                self.retry_window_after_first_call_in_seconds
+                if policy is None
+                else policy.retry_window_after_first_call_in_seconds
+            ),
+            namespace=self.namespace,
+            priority=_priority.get_priority(default=self.priority),
+        )
+        profiler = _hooks.profiler
+        if profiler is None:
+            return clock, backoff_calculator, None
+        return clock, backoff_calculator, RetriedCall(
+            self, clock, backoff_calculator, profiler=profiler, attempts=0
+        )
+
+
+class RetriedCall:
+    """
+    The state of a single call of a `RetriedFunction`, over all its attempts.
+
+    `attempts` is the number of attempts that were started so far. Call `finish`
+    once the call ends, so that it is recorded by the profiler.
+    """
+
+    __slots__ = (
+        "retried",
+        "clock",
+        "backoff_calculator",
+        "profiler",
+        "started_at",
+        "attempts",
+        "backoff_seconds",
+        "outcome",
+        "last_exception",
+    )
+
+    def __init__(
+        self,
+        retried: RetriedFunction,
+        clock: Clock,
+        backoff_calculator: BackoffCalculator,
+        *,
+        profiler: RetryProfiler | None = None,
+        attempts: int = 1,
+    ) -> None:
+        self.retried = retried
+        self.clock = clock
+        self.backoff_calculator = backoff_calculator
+        self.profiler = profiler
+        self.started_at = 0.0 if profiler is None else clock.seconds_since_epoch()
+        self.attempts = attempts
+        self.backoff_seconds = 0.0
+        self.outcome = _hooks.FAILED
+        self.last_exception: Exception | None = None
+
+    def finish(self) -> None:
+        if self.profiler is not None:
+            self.profiler.record(
+                self.retried.call_site,
+                self.outcome,
+                self.attempts,
+                self.backoff_seconds,
+                self.clock.seconds_since_epoch() - self.started_at,
+            )
+
+    def failed(self, e: Exception, attempt_started_at: float) -> bool:
+        """
+        Record that the attempt started at `attempt_started_at` raised `e`, chained
+        to the exception of the previous attempt. Returns whether `e` should be
+        retried.
+        """
+        if self.last_exception is not None:
+            e.__cause__ = self.last_exception
+
+        self.last_exception = e
+        if not isinstance(e, self.retried.retry_on_exceptions):
+            return False
+
+        self._retry_decision(attempt_started_at)
+        return True
+
+    def rejected(self, attempt_started_at: float) -> None:
+        """Record that the result of the attempt should be retried."""
+        self._retry_decision(attempt_started_at)
+
+    def _retry_decision(self, attempt_started_at: float) -> None:
+        if self.clock is _MONOTONIC_CLOCK:
+            attempt_durations = self.retried.attempt_durations
+            attempt_durations.add(self.clock.seconds_since_epoch() - attempt_started_at)
+            self.backoff_calculator.expected_attempt_seconds = attempt_durations.mean_seconds
+
+        if (coordinator := _hooks.coordinator) is not None:
+            coordinator.report_failure(self.retried.namespace)
+
+    def backoff(self) -> float | None:
+        """
+        Returns the seconds to back off before the next attempt, or None if the
+        call should give up.
+        """
+        sleep_seconds = self.backoff_calculator.get_backoff()
+        if sleep_seconds is None:
+            self.outcome = _hooks.GAVE_UP
+        return sleep_seconds
+
+    def try_immediate_retry(self) -> bool:
+        """
+        Returns whether the next attempt can be made without a backoff. If not,
+        use `backoff` to decide whether to retry after a backoff.
+        """
+        return self.backoff_calculator.try_immediate_retry()
+
+    def sleep(self, seconds: float) -> None:
+        self.backoff_seconds += seconds
+        self.clock.sleep(seconds)
+
+    async def async_sleep(self, seconds: float) -> None:
+        self.backoff_seconds += seconds
+        await self.clock.async_sleep(seconds)
+
+    def succeeded(self) -> None:
+        self.outcome = _hooks.SUCCEEDED
 
 
 def retry(
@@ -161,11 +626,14 @@ def retry(
     max_calls_total: int = 3,
     retry_window_after_first_call_in_seconds: int = 60,
     namespace: str | None = None,
+    priority: Priority = Priority.NORMAL,
+    cache: ResultCache | None = None,
+    retry_on_result: Callable[[Any], bool] | None = None,
 ) -> Callable[[Callable[P, R]], Callable[P, R]]:
     """
     Retry a function using a Full Jitter exponential backoff.
 
-    This function exposes four settings:
+    This function exposes seven settings:
 
      - `retry_on_exceptions` - A tuple of exception types to retry on.
      - `max_calls_total` - The maximum number of calls of the decorated
@@ -173,7 +641,19 @@ def retry(
      - `retry_window_after_first_call_in_seconds` - The number of seconds to
        spread out the retries over after the first call.
      - `namespace` - A name with which the wait behavior can be controlled
-       using the `opnieuw.test_util.retry_immediately` contextmanager.
+       using the `opnieuw.test_util.retry_immediately` contextmanager. A retry
+       policy for the namespace (see `opnieuw.policy`) takes precedence over
+       `max_calls_total` and `retry_window_after_first_call_in_seconds`.
+     - `priority` - The `Priority` class of the retries, which decides how they
+       share the retry capacity of the namespace (see `opnieuw.priority`). It can
+       be overridden per call with `opnieuw.priority.with_priority`.
+     - `cache` - An optional `opnieuw.cache.ResultCache` to cache results by
+       the arguments of the call, and to fail fast for arguments that recently
+       exhausted their retries.
+     - `retry_on_result` - An optional predicate on the return value. If it
+       returns True, the call is retried like after an exception in
+       `retry_on_exceptions`, but without raising one. Once the retries are
+       exhausted, the last return value is returned.
 
     This function will:
 
@@ -181,11 +661,13 @@ def retry(
        retry window with exponential backoff and jitter.
      - Call the decorated function until it either succeeds or the retry window
        is over.
+     - Time the attempts of the decorated function that are followed by a
+       retry decision, and skip a retry if the backoff plus the average
+       duration of such an attempt would not fit in the remaining retry
+       window.
 
     This function will NOT:
 
-     - Time the execution of the decorated function. It assumes its execution
-       is instant.
      - Interrupt execution of the decorated function once the retry window is
        over.
      - Guarantee that `max_calls_total` is actually reached. Once the retry
@@ -244,77 +726,142 @@ def retry(
 
 
     def decorator(f: Callable[P, R]) -> Callable[P, R] | Callable[P, Awaitable[R]]:
-        if inspect.iscoroutinefunction(f):
+        retried = RetriedFunction(
+            f,
+            retry_on_exceptions=retry_on_exceptions,
+            max_calls_total=max_calls_total,
+            retry_window_after_first_call_in_seconds=retry_window_after_first_call_in_seconds,
+            namespace=namespace,
+            priority=priority,
+        )
+
+        if retried.is_async:
             async def async_wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
-                backoff_calculator = _get_backoff_calculator_class(namespace)(
-                    MonotonicClock(),
-                    max_calls_total=max_calls_total,
-                    retry_window_after_first_call_in_seconds=retry_window_after_first_call_in_seconds,
-                )
-
-                last_exception = None
-                while True:
-                    try:
-                        # Mypy currently does not propagate type-narrowing info from outside this asyc def
-                        # to its body.
-                        # Therefore, the following cast is necessary.
-                        # You can find a longer writeup on StackOverflow: https://stackoverflow.com/a/75439065/1067339
-                        # The linked-to issue (https://github.com/python/mypy/issues/2608) is nowadays closed;
-                        # MyPy accepts the following in non-strict mode but the cast is still necessary in strict mode.
-                        #
-                        # This cast is sound because of the `inspect.iscoroutinefunction(f)` above.
-                        return await cast(Awaitable[R], f(*args, **kwargs))
-                    except Exception as e:
-                        if last_exception is not None:
-                            e.__cause__ = last_exception
-
-                        last_exception = e
-                        if not isinstance(e, retry_on_exceptions):
-                            raise
-
-                        if (sleep_seconds := backoff_calculator.get_backoff()) is None:
-                            raise
-
-
-                        await asyncio.sleep(sleep_seconds)
+                cache_key = None
+                if cache is not None:
+                    cache_key = cache.make_key(args, kwargs)
+                    if cache_key is not None:
+                        is_cached, cached_result = cache.get(cache_key)
+                        if is_cached:
+                            return cast(R, cached_result)
+
+                clock, backoff_calculator, call = retried.begin()
+                try:
+                    while True:
+                        if call is not None:
+                            call.attempts += 1
+                        attempt_started_at = clock.seconds_since_epoch()
+                        try:
+                            # Mypy currently does not propagate type-narrowing info from outside this asyc def
+                            # to its body.
+                            # Therefore, the following cast is necessary.
+                            # You can find a longer writeup on StackOverflow: https://stackoverflow.com/a/75439065/1067339
+                            # The linked-to issue (https://github.com/python/mypy/issues/2608) is nowadays closed;
+                            # MyPy accepts the following in non-strict mode but the cast is still necessary in strict mode.
+                            #
+                            # This cast is sound because of the `retried.is_async` above.
+                            result = await cast("Awaitable[R]", f(*args, **kwargs))
+                        except Exception as e:
+                            if call is None:
+                                call = RetriedCall(retried, clock, backoff_calculator)
+                            if not call.failed(e, attempt_started_at):
+                                raise
+
+                            if (sleep_seconds := call.backoff()) is None:
+                                if cache_key is not None:
+                                    assert cache is not None
+                                    cache.set_failure(cache_key, e)
+                                raise
+
+                            await call.async_sleep(sleep_seconds)
+                        else:
+                            if retry_on_result is not None and retry_on_result(result):
+                                if call is None:
+                                    call = RetriedCall(retried, clock, backoff_calculator)
+                                call.rejected(attempt_started_at)
+                                if (sleep_seconds := call.backoff()) is None:
+                                    return result
+
+                                await call.async_sleep(sleep_seconds)
+                                continue
+
+                            if call is not None:
+                                call.succeeded()
+                            if cache_key is not None:
+                                assert cache is not None
+                                cache.set(cache_key, result)
+                            return result
+                finally:
+                    if call is not None:
+                        call.finish()
             return functools.wraps(f)(async_wrapper)
         else:
             def sync_wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
-                backoff_calculator = _get_backoff_calculator_class(namespace)(
-                    MonotonicClock(),
-                    max_calls_total=max_calls_total,
-                    retry_window_after_first_call_in_seconds=retry_window_after_first_call_in_seconds,
-                )
-
-                last_exception = None
-                while True:
-                    try:
-                        return f(*args, **kwargs)
-                    except Exception as e:
-                        if last_exception is not None:
-                            e.__cause__ = last_exception
-
-                        last_exception = e
-                        if not isinstance(e, retry_on_exceptions):
-                            raise
-
-                        if (sleep_seconds := backoff_calculator.get_backoff()) is None:
-                            raise
-
-                        time.sleep(sleep_seconds)
+                cache_key = None
+                if cache is not None:
+                    cache_key = cache.make_key(args, kwargs)
+                    if cache_key is not None:
+                        is_cached, cached_result = cache.get(cache_key)
+                        if is_cached:
+                            return cast(R, cached_result)
+
+                clock, backoff_calculator, call = retried.begin()
+                try:
+                    while True:
+                        if call is not None:
+                            call.attempts += 1
+                        attempt_started_at = clock.seconds_since_epoch()
+                        try:
+                            result = f(*args, **kwargs)
+                        except Exception as e:
+                            if call is None:
+                                call = RetriedCall(retried, clock, backoff_calculator)
+                            if not call.failed(e, attempt_started_at):
+                                raise
+
+                            if (sleep_seconds := call.backoff()) is None:
+                                if cache_key is not None:
+                                    assert cache is not None
+                                    cache.set_failure(cache_key, e)
+                                raise
+
+                            call.sleep(sleep_seconds)
+                        else:
+                            if retry_on_result is not None and retry_on_result(result):
+                                if call is None:
+                                    call = RetriedCall(retried, clock, backoff_calculator)
+                                call.rejected(attempt_started_at)
+                                if (sleep_seconds := call.backoff()) is None:
+                                    return result
+
+                                call.sleep(sleep_seconds)
+                                continue
+
+                            if call is not None:
+                                call.succeeded()
+                            if cache_key is not None:
+                                assert cache is not None
+                                cache.set(cache_key, result)
+                            return result
+                finally:
+                    if call is not None:
+                        call.finish()
             return functools.wraps(f)(sync_wrapper)
     return decorator
 
 # We expose `retry_async` for backwards-compatibility.
 # However, nowadays the main `retry` decorator is able
 # to accept both sync and async functions directly.
-@typing_extensions.deprecated("Use the normal `retry` instead, as works for both sync and async functions", category=None)
+@deprecated("Use the normal `retry` instead, as works for both sync and async functions", category=None)
 def retry_async(
     *,
     retry_on_exceptions: type[Exception] | tuple[type[Exception], ...],
     max_calls_total: int = 3,
     retry_window_after_first_call_in_seconds: int = 60,
     namespace: str | None = None,
+    priority: Priority = Priority.NORMAL,
+    cache: ResultCache | None = None,
+    retry_on_result: Callable[[Any], bool] | None = None,
 ) -> Callable[[Callable[P, Awaitable[R]]], Callable[P, Awaitable[R]]]:
     """
     Functionally the same as `retry`.
@@ -344,5 +891,8 @@ def retry_async(
         retry_on_exceptions=retry_on_exceptions,
         max_calls_total=max_calls_total,
         retry_window_after_first_call_in_seconds=retry_window_after_first_call_in_seconds,
-        namespace=namespace
+        namespace=namespace,
+        priority=priority,
+        cache=cache,
+        retry_on_result=retry_on_result,
     )
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
-from contextlib import _GeneratorContextManager
+from collections.abc import Iterator
+from contextlib import _GeneratorContextManager, contextmanager
 
-from .retries import BackoffCalculator, replace_backoff_calculator
+from .clock import DummyClock
+from .retries import BackoffCalculator, replace_backoff_calculator, replace_clock
 
 
 class WaitLessBackoff(BackoffCalculator):
@@ -23,3 +25,22 @@ def retry_immediately(namespace: str | None = None) -> _GeneratorContextManager[
     without a provided namespace will not wait.
     """
     return replace_backoff_calculator(WaitLessBackoff, namespace=namespace)
+
+
+@contextmanager
+def virtual_time(
+    namespace: str | None = None, clock: DummyClock | None = None
+) -> Iterator[DummyClock]:
+    """
+    Returns a contextmanager that runs all `retry` and `retry_async` decorators with
+    the provided namespace in virtual time.
+
+    Unlike `retry_immediately`, the regular `BackoffCalculator` stays in place, so
+    the jittered backoffs and the retry window behave exactly like in production.
+    Sleeping between attempts advances the yielded `DummyClock` instead of waiting,
+    so tests can assert on the elapsed virtual time without actually sleeping.
+    """
+    if clock is None:
+        clock = DummyClock()
+    with replace_clock(clock, namespace=namespace):
+        yield clock
@@ -0,0 +1,105 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+import random
+import time
+import unittest
+from unittest import mock
+
+from opnieuw.clock import DummyClock
+from opnieuw.retries import BackoffCalculator, _AttemptDurations, retry
+from opnieuw.test_util import virtual_time
+
+
+def _upper_bound(a: float, b: float) -> float:
+    return b
+
+
+class TestAttemptDurations(unittest.TestCase):
+    def test_moving_average(self) -> None:
+        durations = _AttemptDurations()
+        self.assertIsNone(durations.mean_seconds)
+
+        durations.add(10.0)
+        self.assertEqual(durations.mean_seconds, 10.0)
+
+        durations.add(0.0)
+        self.assertAlmostEqual(durations.mean_seconds, 10.0 * (1 - _AttemptDurations.SMOOTHING))
+
+    @mock.patch.object(random, "uniform", side_effect=_upper_bound)
+    def test_backoff_that_would_overrun_is_skipped(self, mocked_random) -> None:
+        def calculator() -> BackoffCalculator:
+            return BackoffCalculator(
+                DummyClock(), max_calls_total=3, retry_window_after_first_call_in_seconds=60
+            )
+
+        # The first backoff is 60 / 3 = 20 seconds.
+        self.assertEqual(calculator().get_backoff(), 20.0)
+
+        backoff_calculator = calculator()
+        backoff_calculator.expected_attempt_seconds = 30.0
+        self.assertEqual(backoff_calculator.get_backoff(), 20.0)
+
+        backoff_calculator = calculator()
+        backoff_calculator.expected_attempt_seconds = 45.0
+        self.assertIsNone(backoff_calculator.get_backoff())
+
+    @mock.patch.object(random, "uniform", return_value=0.0)
+    def test_slow_attempts_that_would_overrun_are_skipped(self, mocked_random) -> None:
+        calls = 0
+
+        @retry(
+            retry_on_exceptions=ValueError,
+            max_calls_total=3,
+            retry_window_after_first_call_in_seconds=1,
+        )
+        def slow_call() -> None:
+            nonlocal calls
+            calls += 1
+            time.sleep(0.4)
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            slow_call()
+
+        # After the second attempt, less than 0.4 seconds of the window is left.
+        self.assertEqual(calls, 2)
+
+    @mock.patch.object(random, "uniform", return_value=0.0)
+    def test_durations_are_per_function_and_real_time_only(self, mocked_random) -> None:
+        clock = DummyClock()
+
+        @retry(
+            retry_on_exceptions=ValueError,
+            max_calls_total=3,
+            retry_window_after_first_call_in_seconds=100,
+        )
+        def slow_virtual_call() -> None:
+            clock.advance_to(clock.time + 50)
+            raise ValueError
+
+        calls = 0
+
+        @retry(
+            retry_on_exceptions=ValueError,
+            max_calls_total=3,
+            retry_window_after_first_call_in_seconds=10,
+        )
+        def fast_call() -> None:
+            nonlocal calls
+            calls += 1
+            raise ValueError
+
+        with virtual_time(clock=clock):
+            with self.assertRaises(ValueError):
+                slow_virtual_call()
+
+        with self.assertRaises(ValueError):
+            fast_call()
+        self.assertEqual(calls, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+import unittest
+
+from opnieuw.cache import ResultCache
+from opnieuw.clock import DummyClock
+from opnieuw.retries import retry
+from opnieuw.test_util import retry_immediately
+from tests.utils import AsyncTestCase
+
+
+class TestResultCache(AsyncTestCase):
+    def setUp(self) -> None:
+        self.calls: list[str] = []
+        self.fail = False
+        self.clock = DummyClock()
+        self.cache = ResultCache(
+            ttl_seconds=10.0, negative_ttl_seconds=2.0, maxsize=2, clock=self.clock
+        )
+
+        @retry(
+            retry_on_exceptions=ConnectionError,
+            max_calls_total=3,
+            retry_window_after_first_call_in_seconds=1,
+            cache=self.cache,
+        )
+        def lookup(key: str, *, suffix: str = "") -> str:
+            self.calls.append(key)
+            if self.fail:
+                raise ConnectionError(key)
+            return key + suffix
+
+        @retry(
+            retry_on_exceptions=ConnectionError,
+            max_calls_total=3,
+            retry_window_after_first_call_in_seconds=1,
+            cache=self.cache,
+        )
+        async def lookup_async(key: str) -> str:
+            self.calls.append(key)
+            return key
+
+        self.lookup = lookup
+        self.lookup_async = lookup_async
+
+    def test_results_are_cached_until_ttl(self) -> None:
+        self.assertEqual(self.lookup("a"), "a")
+        self.assertEqual(self.lookup("a"), "a")
+        self.assertEqual(self.lookup("a", suffix="!"), "a!")
+        self.assertEqual(self.calls, ["a", "a"])
+
+        self.clock.advance_to(10.0)
+        self.assertEqual(self.lookup("a"), "a")
+        self.assertEqual(self.calls, ["a", "a", "a"])
+
+    def test_lru_eviction(self) -> None:
+        self.lookup("a")
+        self.lookup("b")
+        self.lookup("a")
+        self.lookup("c")
+        self.assertEqual(len(self.cache), 2)
+
+        # "b" was least recently used, so it got evicted.
+        self.lookup("a")
+        self.lookup("b")
+        self.assertEqual(self.calls, ["a", "b", "c", "b"])
+
+    def test_exhausted_retries_fail_fast(self) -> None:
+        self.fail = True
+        with retry_immediately():
+            with self.assertRaises(ConnectionError) as first:
+                self.lookup("a")
+            self.assertEqual(self.calls, ["a", "a", "a"])
+
+            with self.assertRaises(ConnectionError) as second:
+                self.lookup("a")
+            self.assertIsNot(second.exception, first.exception)
+            self.assertEqual(second.exception.args, first.exception.args)
+            # The failed attempts are not kept alive by the cache.
+            self.assertIsNone(second.exception.__cause__)
+            self.assertEqual(self.calls, ["a", "a", "a"])
+
+            self.fail = False
+            self.clock.advance_to(2.0)
+            self.assertEqual(self.lookup("a"), "a")
+
+    def test_cached_exceptions_keep_their_attributes(self) -> None:
+        class HTTPError(Exception):
+            def __init__(self, message: str, status: int = 500) -> None:
+                super().__init__(message)
+                self.status = status
+
+        cache = ResultCache(ttl_seconds=1.0, negative_ttl_seconds=1.0, clock=self.clock)
+        try:
+            try:
+                raise KeyError("context")
+            except KeyError:
+                raise HTTPError("boom", status=503)
+        except HTTPError as e:
+            cache.set_failure("a", e)
+
+        for _ in range(2):
+            with self.assertRaises(HTTPError) as raised:
+                cache.get("a")
+            self.assertEqual(raised.exception.args, ("boom",))
+            self.assertEqual(raised.exception.status, 503)
+            self.assertIsNone(raised.exception.__context__)
+
+    def test_exceptions_that_cannot_be_copied_are_not_cached(self) -> None:
+        class LookupFailed(Exception):
+            def __init__(self, key: str, reason: str) -> None:
+                super().__init__(f"{key}: {reason}")
+
+        cache = ResultCache(ttl_seconds=1.0, negative_ttl_seconds=1.0, clock=self.clock)
+        with self.assertLogs("opnieuw.cache", "WARNING"):
+            cache.set_failure("a", LookupFailed("a", "timeout"))
+        self.assertEqual(cache.get("a"), (False, None))
+
+    def test_unhashable_arguments_are_not_cached(self) -> None:
+        @retry(retry_on_exceptions=ConnectionError, cache=self.cache)
+        def length(items: list) -> int:
+            self.calls.append("length")
+            return len(items)
+
+        self.assertEqual(length([1, 2]), 2)
+        self.assertEqual(length([1, 2]), 2)
+        self.assertEqual(self.calls, ["length", "length"])
+
+    def test_async(self) -> None:
+        self.assertEqual(self._run_async(self.lookup_async("a")), "a")
+        self.assertEqual(self._run_async(self.lookup_async("a")), "a")
+        self.assertEqual(self.calls, ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,7 +6,7 @@ import time
 import unittest
 from collections import Counter
 
-from opnieuw.retries import retry, retry_async
+from opnieuw.retries import _get_namespace, retry, retry_async
 from opnieuw.test_util import retry_immediately
 from opnieuw.util import no_retries
 from tests.utils import AsyncTestCase
@@ -246,5 +246,30 @@ class TestThreadedContext(unittest.TestCase):
         ]
 
 
+class TestNamespaceRegistry(unittest.TestCase):
+    def test_concurrent_first_use(self) -> None:
+        """
+        Threads that use a namespace for the first time at the same moment should
+        all end up with the same namespace state.
+        """
+        n_threads = 8
+        barrier = threading.Barrier(n_threads)
+        states = []
+
+        def _first_use() -> None:
+            barrier.wait()
+            states.append(_get_namespace("concurrent_first_use"))
+
+        threads = [threading.Thread(target=_first_use) for _ in range(n_threads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(states), n_threads)
+        self.assertTrue(all(state is states[0] for state in states))
+        self.assertIs(_get_namespace("concurrent_first_use"), states[0])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,235 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from opnieuw.clock import DummyClock
+from opnieuw.coordinator import (
+    CoordinatorClient,
+    CoordinatorServer,
+    FailureTracker,
+    LocalCoordinator,
+    set_coordinator,
+)
+from opnieuw.retries import retry
+from opnieuw.test_util import virtual_time
+
+
+class TestFailureTracker(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = DummyClock()
+        self.tracker = FailureTracker(
+            self.clock,
+            failure_threshold=3,
+            window_seconds=10.0,
+            backoff_seconds=5.0,
+            max_backoff_seconds=8.0,
+        )
+
+    def test_trips_after_threshold(self) -> None:
+        self.tracker.add_failures("ns", 2)
+        self.assertEqual(self.tracker.remaining_backoff("ns"), 0.0)
+
+        self.tracker.add_failures("ns", 1)
+        self.assertEqual(self.tracker.remaining_backoff("ns"), 5.0)
+        self.assertEqual(self.tracker.remaining_backoff("other"), 0.0)
+        self.assertEqual(self.tracker.backoffs(), {"ns": 5.0})
+
+        self.clock.advance_to(5.0)
+        self.assertEqual(self.tracker.remaining_backoff("ns"), 0.0)
+        self.assertEqual(self.tracker.backoffs(), {})
+
+    def test_failures_outside_window_are_forgotten(self) -> None:
+        self.tracker.add_failures(None, 2)
+        self.clock.advance_to(10.0)
+        self.tracker.add_failures(None, 2)
+        self.assertEqual(self.tracker.remaining_backoff(None), 0.0)
+
+    def test_repeated_trips_escalate(self) -> None:
+        self.tracker.add_failures("ns", 3)
+        self.clock.advance_to(6.0)
+        self.tracker.add_failures("ns", 3)
+        self.assertEqual(self.tracker.remaining_backoff("ns"), 8.0)
+
+
+class TestCoordinatedRetries(unittest.TestCase):
+    def setUp(self) -> None:
+        self.counter = 0
+        self.clock = DummyClock()
+        self.coordinator = LocalCoordinator(
+            FailureTracker(self.clock, failure_threshold=1, backoff_seconds=30.0)
+        )
+        set_coordinator(self.coordinator)
+
+    def tearDown(self) -> None:
+        set_coordinator(None)
+
+    @retry(
+        retry_on_exceptions=ValueError,
+        max_calls_total=3,
+        retry_window_after_first_call_in_seconds=60,
+        namespace="coordinated",
+    )
+    def always_fails(self) -> None:
+        self.counter += 1
+        raise ValueError
+
+    @mock.patch.object(random, "uniform", return_value=1.0)
+    def test_backoff_respects_host_wide_signal(self, mocked_random) -> None:
+        with virtual_time("coordinated", clock=self.clock):
+            with self.assertRaises(ValueError):
+                self.always_fails()
+
+        # The first failure trips the coordinator, so the first backoff lasts the
+        # host-wide 30 seconds plus jitter. The second failure trips it again, and
+        # the escalated host-wide backoff of 60 seconds no longer fits the window.
+        self.assertEqual(self.counter, 2)
+        self.assertEqual(self.clock.time, 30.0 + 1.0)
+
+    @mock.patch.object(random, "uniform", return_value=1.0)
+    def test_gives_up_when_host_backoff_exceeds_window(self, mocked_random) -> None:
+        self.coordinator.tracker.backoff_seconds = 120.0
+        with virtual_time("coordinated", clock=self.clock):
+            with self.assertRaises(ValueError):
+                self.always_fails()
+
+        self.assertEqual(self.counter, 1)
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "Unix domain sockets are not available")
+class TestCoordinatorDaemon(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.tmpdir.name, "coordinator.sock")
+        self.server = CoordinatorServer(
+            path, FailureTracker(DummyClock(), failure_threshold=2, backoff_seconds=30.0)
+        )
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.start()
+        self.client = CoordinatorClient(path, flush_interval_seconds=0.01)
+        self.other_client = CoordinatorClient(path, flush_interval_seconds=0.01)
+
+    def tearDown(self) -> None:
+        self.client.close()
+        self.other_client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.server_thread.join()
+        self.tmpdir.cleanup()
+
+    def test_backoff_is_shared_between_clients(self) -> None:
+        self.client.report_failure(None)
+        self.client.report_failure(None)
+        self.client.flush()
+
+        deadline = time.monotonic() + 5.0
+        while self.other_client.remaining_backoff(None) == 0.0:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+        self.assertGreater(self.client.remaining_backoff(None), 29.0)
+        self.assertEqual(self.other_client.remaining_backoff("other"), 0.0)
+
+    def test_unreachable_daemon(self) -> None:
+        client = CoordinatorClient(
+            os.path.join(self.tmpdir.name, "missing.sock"), flush_interval_seconds=0.01
+        )
+        client.report_failure(None)
+        client.flush()
+        self.assertEqual(client.remaining_backoff(None), 0.0)
+        client.close()
+
+    def test_invalid_requests_are_skipped(self) -> None:
+        requests = [
+            b"{not json\n",
+            b'{"failures": [[["unhashable"], 1]]}\n',
+            b'{"failures": [[null, "2"]]}\n',
+            b'{"failures": [[null]]}\n',
+            b'{"failures": [[null, 2]]}\n',
+        ]
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(5.0)
+            sock.connect(self.server.server_address)
+            with sock.makefile("rb") as reader:
+                with self.assertLogs("opnieuw.coordinator", "WARNING") as logs:
+                    replies = []
+                    for request in requests:
+                        sock.sendall(request)
+                        replies.append(reader.readline())
+
+        self.assertEqual(len(logs.records), 4)
+        # Every request gets a reply, but only the valid one counts.
+        self.assertEqual(replies[:4], [b'{"backoffs": []}\n'] * 4)
+        self.assertIn(b"[null, 30.0]", replies[4])
+
+    def test_stale_socket_is_replaced(self) -> None:
+        path = os.path.join(self.tmpdir.name, "stale.sock")
+        # A socket file that nobody listens on, as left behind by a crash.
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(path)
+
+        server = CoordinatorServer(path, mode=0o600)
+        try:
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        finally:
+            server.server_close()
+
+    def test_socket_in_use_is_not_replaced(self) -> None:
+        with self.assertRaises(OSError):
+            CoordinatorServer(self.server.server_address)
+        self.client.flush()
+        self.assertTrue(os.path.exists(self.server.server_address))
+
+    def test_invalid_replies(self) -> None:
+        path = os.path.join(self.tmpdir.name, "invalid.sock")
+        valid = b'{"backoffs": [[null, 30.0]]}\n'
+        # A truncated line, and a reply of another protocol version.
+        replies = [valid, b'{"backoffs": [[null\n', b'{"version": 2}\n', valid]
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen()
+        listener.settimeout(5.0)
+
+        def serve() -> None:
+            while replies:
+                try:
+                    conn, _ = listener.accept()
+                except OSError:
+                    return
+                with conn, conn.makefile("rb") as reader:
+                    while replies and reader.readline():
+                        conn.sendall(replies.pop(0))
+
+        server_thread = threading.Thread(target=serve)
+        server_thread.start()
+        client = CoordinatorClient(path, flush_interval_seconds=60.0)
+        try:
+            client.flush()
+            self.assertGreater(client.remaining_backoff(None), 29.0)
+
+            for _ in range(2):
+                with self.assertLogs("opnieuw.coordinator", "WARNING"):
+                    client.flush()
+                self.assertEqual(client.remaining_backoff(None), 0.0)
+
+            # The client reconnects and recovers.
+            client.flush()
+            self.assertGreater(client.remaining_backoff(None), 29.0)
+        finally:
+            client.close()
+            server_thread.join()
+            listener.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
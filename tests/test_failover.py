@@ -0,0 +1,264 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+import functools
+import random
+import unittest
+from unittest import mock
+
+from opnieuw.clock import DummyClock
+from opnieuw.coordinator import FailureTracker, LocalCoordinator, set_coordinator
+from opnieuw.failover import TargetPool, retry_with_failover
+from opnieuw.overload import OverloadDetector, set_overload_detector
+from opnieuw.priority import RetryCapacity, set_retry_capacity
+from opnieuw.test_util import virtual_time
+from tests.utils import AsyncTestCase
+
+
+class TestTargetPool(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = DummyClock()
+        self.pool = TargetPool(["a", "b"], half_life_seconds=10, clock=self.clock)
+
+    def test_prefers_healthy_targets(self) -> None:
+        self.pool.record(0, success=False, latency_seconds=0.1)
+        self.assertEqual(self.pool.choose(), 1)
+        self.assertEqual(self.pool.choose(exclude={1}), 0)
+        self.assertEqual(self.pool.choose(exclude={0, 1}), 1)
+
+    def test_prefers_fast_targets(self) -> None:
+        self.pool.record(0, success=True, latency_seconds=1.0)
+        self.pool.record(1, success=True, latency_seconds=0.1)
+        self.assertEqual(self.pool.choose(), 1)
+
+    def test_error_rate_decays(self) -> None:
+        for _ in range(5):
+            self.pool.record(0, success=False, latency_seconds=0.0)
+        self.assertFalse(self.pool.is_healthy(0))
+
+        error_rate = self.pool.error_rate(0)
+        self.clock.advance_to(10)
+        self.assertAlmostEqual(self.pool.error_rate(0), error_rate / 2)
+        self.clock.advance_to(30)
+        self.assertTrue(self.pool.is_healthy(0))
+
+    def test_needs_targets(self) -> None:
+        with self.assertRaises(ValueError):
+            TargetPool([])
+
+
+class _AlwaysOverloaded(OverloadDetector):
+    def is_overloaded(self) -> bool:
+        return True
+
+
+class TestRetryWithFailover(AsyncTestCase):
+    def setUp(self) -> None:
+        self.pool = TargetPool(["a", "b", "c"], clock=DummyClock())
+        # Rank the targets a, b, c, so that the order of attempts is known.
+        for index, latency_seconds in enumerate([0.10, 0.11, 0.12]):
+            self.pool.record(index, success=True, latency_seconds=latency_seconds)
+        self.down: set[str] = set()
+        self.calls: list[str] = []
+
+    def _call(self, target: str) -> str:
+        self.calls.append(target)
+        if target in self.down:
+            raise ConnectionError(target)
+        return target
+
+    def test_fails_over_without_backoff(self) -> None:
+        @retry_with_failover(
+            self.pool,
+            retry_on_exceptions=ConnectionError,
+            max_calls_total=3,
+            retry_window_after_first_call_in_seconds=60,
+        )
+        def fetch(target: str) -> str:
+            return self._call(target)
+
+        self.down = {"a", "b"}
+        with virtual_time() as clock:
+            self.assertEqual(fetch(), "c")
+            self.assertEqual(clock.seconds_since_epoch(), 0)
+        self.assertEqual(self.calls, ["a", "b", "c"])
+
+        # The failed targets are avoided by the next call.
+        self.calls.clear()
+        self.assertEqual(fetch(), "c")
+        self.assertEqual(self.calls, ["c"])
+
+    def test_backs_off_when_all_targets_failed(self) -> None:
+        @retry_with_failover(
+            self.pool,
+            retry_on_exceptions=ConnectionError,
+            max_calls_total=5,
+            retry_window_after_first_call_in_seconds=60,
+        )
+        def fetch(target: str) -> str:
+            return self._call(target)
+
+        self.down = {"a", "b", "c"}
+        with virtual_time() as clock:
+            with self.assertRaises(ConnectionError):
+                fetch()
+            self.assertGreater(clock.seconds_since_epoch(), 0)
+        self.assertEqual(self.calls[:3], ["a", "b", "c"])
+        self.assertEqual(len(self.calls), 5)
+
+    @mock.patch.object(random, "uniform", side_effect=lambda a, b: b)
+    def test_fails_over_when_backoff_would_not_fit(self, mocked_random) -> None:
+        @retry_with_failover(
+            self.pool,
+            retry_on_exceptions=ConnectionError,
+            max_calls_total=3,
+            retry_window_after_first_call_in_seconds=10,
+        )
+        def fetch(target: str) -> str:
+            if target == "a":
+                clock.advance_to(clock.time + 8)
+            return self._call(target)
+
+        # The first backoff of 10 / 3 seconds does not fit in the remaining 2
+        # seconds of the window, but an attempt on "b" without a backoff does.
+        self.down = {"a"}
+        with virtual_time() as clock:
+            self.assertEqual(fetch(), "b")
+        self.assertEqual(self.calls, ["a", "b"])
+
+    def test_no_failover_after_window(self) -> None:
+        @retry_with_failover(
+            self.pool,
+            retry_on_exceptions=ConnectionError,
+            max_calls_total=3,
+            retry_window_after_first_call_in_seconds=10,
+        )
+        def fetch(target: str) -> str:
+            clock.advance_to(clock.time + 11)
+            return self._call(target)
+
+        self.down = {"a"}
+        with virtual_time() as clock:
+            with self.assertRaises(ConnectionError):
+                fetch()
+        self.assertEqual(self.calls, ["a"])
+
+    def _fetch_with_failover(self, namespace: str | None = None):  # type: ignore[no-untyped-def]
+        @retry_with_failover(
+            self.pool,
+            retry_on_exceptions=ConnectionError,
+            max_calls_total=4,
+            retry_window_after_first_call_in_seconds=60,
+            namespace=namespace,
+        )
+        def fetch(target: str) -> str:
+            return self._call(target)
+
+        return fetch
+
+    def test_no_failover_while_overloaded(self) -> None:
+        fetch = self._fetch_with_failover()
+        self.down = {"a", "b", "c"}
+        set_overload_detector(_AlwaysOverloaded())
+        try:
+            with virtual_time():
+                with self.assertRaises(ConnectionError):
+                    fetch()
+        finally:
+            set_overload_detector(None)
+        self.assertEqual(self.calls, ["a"])
+
+    def test_no_failover_without_retry_capacity(self) -> None:
+        fetch = self._fetch_with_failover(namespace="failover_capacity")
+        self.down = {"a", "b", "c"}
+        set_retry_capacity(
+            RetryCapacity(retries_per_second=0.0, burst=0), namespace="failover_capacity"
+        )
+        try:
+            with virtual_time("failover_capacity"):
+                with self.assertRaises(ConnectionError):
+                    fetch()
+        finally:
+            set_retry_capacity(None, namespace="failover_capacity")
+        self.assertEqual(self.calls, ["a"])
+
+    def test_host_wide_backoff_applies_to_failover(self) -> None:
+        clock = DummyClock()
+        fetch = self._fetch_with_failover()
+        self.down = {"a"}
+        set_coordinator(
+            LocalCoordinator(FailureTracker(clock, failure_threshold=1, backoff_seconds=5.0))
+        )
+        try:
+            with virtual_time(clock=clock):
+                self.assertEqual(fetch(), "b")
+        finally:
+            set_coordinator(None)
+        self.assertEqual(self.calls, ["a", "b"])
+        self.assertGreaterEqual(clock.time, 5.0)
+
+    def test_other_exceptions_do_not_count_against_target(self) -> None:
+        @retry_with_failover(
+            self.pool,
+            retry_on_exceptions=ConnectionError,
+            max_calls_total=3,
+            retry_window_after_first_call_in_seconds=60,
+        )
+        def fetch(target: str) -> str:
+            raise ValueError
+
+        for _ in range(5):
+            with self.assertRaises(ValueError):
+                fetch()
+        self.assertEqual(self.pool.error_rate(0), 0.0)
+
+    def test_partial(self) -> None:
+        def fetch(target: str, suffix: str) -> str:
+            return self._call(target) + suffix
+
+        fetch_bang = retry_with_failover(
+            self.pool,
+            retry_on_exceptions=ConnectionError,
+            max_calls_total=3,
+            retry_window_after_first_call_in_seconds=60,
+        )(functools.partial(fetch, suffix="!"))
+
+        self.down = {"a"}
+        with virtual_time():
+            self.assertEqual(fetch_bang(), "b!")
+
+    def test_does_not_retry_other_exceptions(self) -> None:
+        @retry_with_failover(
+            self.pool,
+            retry_on_exceptions=ConnectionError,
+            max_calls_total=3,
+            retry_window_after_first_call_in_seconds=60,
+        )
+        def fetch(target: str) -> str:
+            self.calls.append(target)
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            fetch()
+        self.assertEqual(len(self.calls), 1)
+
+    def test_async(self) -> None:
+        @retry_with_failover(
+            self.pool,
+            retry_on_exceptions=ConnectionError,
+            max_calls_total=3,
+            retry_window_after_first_call_in_seconds=60,
+        )
+        async def fetch(target: str, suffix: str) -> str:
+            return self._call(target) + suffix
+
+        self.down = {"a", "b"}
+        with virtual_time():
+            self.assertEqual(self._run_async(fetch("!")), "c!")
+        self.assertEqual(self.calls, ["a", "b", "c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
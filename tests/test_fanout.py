@@ -0,0 +1,197 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import threading
+import time
+import unittest
+from collections.abc import AsyncIterator
+
+from opnieuw.fanout import FanOutAborted, ItemResult, fan_out, fan_out_threads
+from opnieuw.retries import retry
+from tests.utils import AsyncTestCase
+
+
+class TestFanOut(AsyncTestCase):
+    def _collect(self, results: AsyncIterator[ItemResult]) -> list[ItemResult]:
+        async def collect() -> list[ItemResult]:
+            return [result async for result in results]
+
+        return self._run_async(collect())
+
+    def test_results_per_item(self) -> None:
+        async def double(x: int) -> int:
+            if x == 2:
+                raise ValueError(x)
+            await asyncio.sleep(0.01 * (5 - x))
+            return 2 * x
+
+        results = self._collect(fan_out(double, range(5), max_concurrency=5))
+        # Items yield as they complete, so the slowest item comes last.
+        self.assertEqual(results[-1].index, 0)
+
+        by_index = {result.index: result for result in results}
+        self.assertEqual(sorted(by_index), [0, 1, 2, 3, 4])
+        self.assertIsInstance(by_index[2].exception, ValueError)
+        self.assertEqual([by_index[i].result for i in (0, 1, 3, 4)], [0, 2, 6, 8])
+
+    def test_max_concurrency(self) -> None:
+        running = 0
+        max_running = 0
+
+        async def work(x: int) -> int:
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.001)
+            running -= 1
+            return x
+
+        results = self._collect(fan_out(work, range(20), max_concurrency=3))
+        self.assertEqual(len(results), 20)
+        self.assertEqual(max_running, 3)
+
+    def test_deadline_aborts_remaining_items(self) -> None:
+        async def work(x: int) -> int:
+            await asyncio.sleep(0 if x == 0 else 10)
+            return x
+
+        started_at = time.monotonic()
+        results = self._collect(
+            fan_out(work, range(4), max_concurrency=2, deadline_seconds=0.05)
+        )
+        self.assertLess(time.monotonic() - started_at, 5)
+        self.assertEqual(results[0], ItemResult(0, result=0))
+        self.assertEqual([result.index for result in results[1:]], [1, 2, 3])
+        for result in results[1:]:
+            self.assertIsInstance(result.exception, FanOutAborted)
+
+    def test_max_failures_aborts_remaining_items(self) -> None:
+        calls = []
+
+        async def fail(x: int) -> int:
+            calls.append(x)
+            raise ValueError(x)
+
+        results = self._collect(fan_out(fail, range(10), max_concurrency=1, max_failures=2))
+        self.assertEqual(calls, [0, 1])
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(isinstance(r.exception, FanOutAborted) for r in results[2:]))
+
+    def test_abort_streams_remaining_items(self) -> None:
+        async def fail(x: int) -> int:
+            raise ValueError(x)
+
+        async def collect() -> list[ItemResult]:
+            results = fan_out(fail, itertools.count(), max_concurrency=2, max_failures=2)
+            return [result async for result in _take(results, 10)]
+
+        results = self._run_async(collect())
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(isinstance(r.exception, FanOutAborted) for r in results[2:]))
+
+    def test_results_completed_during_cancellation_are_kept(self) -> None:
+        async def work(x: int) -> str:
+            if x == 0:
+                raise ValueError(x)
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                # Finishes its work despite the cancellation.
+                return "finished"
+            return "slept"
+
+        results = self._collect(fan_out(work, range(3), max_concurrency=2, max_failures=1))
+        self.assertEqual(
+            [(r.index, r.result) for r in results[1:]], [(1, "finished"), (2, None)]
+        )
+        self.assertIsInstance(results[2].exception, FanOutAborted)
+
+    def test_retries_stop_at_deadline(self) -> None:
+        calls = 0
+
+        @retry(
+            retry_on_exceptions=ConnectionError,
+            max_calls_total=10,
+            retry_window_after_first_call_in_seconds=3600,
+        )
+        async def flaky(x: int) -> int:
+            nonlocal calls
+            calls += 1
+            raise ConnectionError
+
+        started_at = time.monotonic()
+        results = self._collect(fan_out(flaky, [0], max_concurrency=1, deadline_seconds=0.5))
+        self.assertLess(time.monotonic() - started_at, 5)
+        self.assertIsInstance(results[0].exception, ConnectionError)
+        self.assertLess(calls, 10)
+
+    def test_validation(self) -> None:
+        async def work(x: int) -> int:
+            return x
+
+        with self.assertRaises(ValueError):
+            self._collect(fan_out(work, [1], max_concurrency=0))
+
+
+async def _take(results: AsyncIterator[ItemResult], n: int) -> AsyncIterator[ItemResult]:
+    async for result in results:
+        yield result
+        n -= 1
+        if n == 0:
+            await results.aclose()
+            return
+
+
+class TestFanOutThreads(unittest.TestCase):
+    def test_results_per_item(self) -> None:
+        def square(x: int) -> int:
+            if x == 3:
+                raise ValueError(x)
+            return x * x
+
+        results = list(fan_out_threads(square, range(5), max_concurrency=2))
+        by_index = {result.index: result for result in results}
+        self.assertEqual(sorted(by_index), [0, 1, 2, 3, 4])
+        self.assertFalse(by_index[3].ok)
+        self.assertEqual([by_index[i].result for i in (0, 1, 2, 4)], [0, 1, 4, 16])
+
+    def test_abort_streams_remaining_items(self) -> None:
+        def fail(x: int) -> int:
+            raise ValueError(x)
+
+        results = list(
+            itertools.islice(
+                fan_out_threads(fail, itertools.count(), max_concurrency=2, max_failures=2), 10
+            )
+        )
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(isinstance(r.exception, FanOutAborted) for r in results[4:]))
+
+    def test_deadline_aborts_remaining_items(self) -> None:
+        release = threading.Event()
+
+        def work(x: int) -> int:
+            if x > 0:
+                release.wait()
+            return x
+
+        try:
+            results = list(
+                fan_out_threads(work, range(5), max_concurrency=2, deadline_seconds=0.05)
+            )
+        finally:
+            release.set()
+
+        self.assertEqual(results[0], ItemResult(0, result=0))
+        self.assertEqual([result.index for result in results[1:]], [1, 2, 3, 4])
+        self.assertTrue(all(isinstance(r.exception, FanOutAborted) for r in results[1:]))
+
+
+if __name__ == "__main__":
+    unittest.main()
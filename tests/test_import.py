@@ -0,0 +1,30 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+import subprocess
+import sys
+import unittest
+
+from benchmarks.bench_import_time import FORBIDDEN_MODULES
+
+
+class TestImport(unittest.TestCase):
+    def test_import_is_lazy(self) -> None:
+        """
+        Importing opnieuw should not import modules that are only needed by async
+        code, for type checking, or once something is retried.
+        """
+        code = (
+            "import sys, opnieuw\n"
+            f"print(' '.join(m for m in {FORBIDDEN_MODULES!r} if m in sys.modules))"
+        )
+        proc = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        self.assertEqual(proc.stdout.strip(), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,8 @@
 #
 # Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
 
+import asyncio
+import functools
 import random
 import time
 import unittest
@@ -10,7 +12,7 @@ import warnings
 from unittest import mock
 
 from opnieuw.clock import DummyClock, MonotonicClock
-from opnieuw.retries import BackoffCalculator, retry, retry_async
+from opnieuw.retries import BackoffCalculator, _is_coroutine_function, retry, retry_async
 from opnieuw.test_util import retry_immediately
 
 
@@ -26,6 +28,24 @@ class TestBackoffCalculator(unittest.TestCase):
         self.assertEqual(None, retry_state.get_backoff())
 
 
+class TestIsCoroutineFunction(unittest.TestCase):
+    def test_callables_without_code(self) -> None:
+        async def fetch_async(x: int) -> int:
+            return x
+
+        def fetch(x: int) -> int:
+            return x
+
+        class Fetcher:
+            def __call__(self) -> int:
+                return 1
+
+        self.assertTrue(_is_coroutine_function(fetch_async))
+        self.assertTrue(_is_coroutine_function(functools.partial(fetch_async, 1)))
+        self.assertFalse(_is_coroutine_function(functools.partial(fetch, 1)))
+        self.assertFalse(_is_coroutine_function(Fetcher()))
+
+
 class TestRetryClock(unittest.TestCase):
     def setUp(self) -> None:
         self.clock = DummyClock()
@@ -146,6 +166,48 @@ class TestExceptionChaining(unittest.TestCase):
                 self.assertIsInstance(e.__cause__.__cause__, TypeError)
 
 
+class TestDecorateCallables(unittest.TestCase):
+    def setUp(self) -> None:
+        self.calls = 0
+
+    def _fail_once(self, x: int) -> int:
+        self.calls += 1
+        if self.calls == 1:
+            raise ValueError
+        return x
+
+    def test_partial_of_async_function(self) -> None:
+        async def fetch(x: int) -> int:
+            return self._fail_once(x)
+
+        fetch_one = retry(
+            retry_on_exceptions=ValueError,
+            max_calls_total=3,
+            retry_window_after_first_call_in_seconds=1,
+        )(functools.partial(fetch, 1))
+
+        with retry_immediately():
+            self.assertEqual(asyncio.run(fetch_one()), 1)
+        self.assertEqual(self.calls, 2)
+
+    def test_callable_object(self) -> None:
+        test = self
+
+        class Fetcher:
+            def __call__(self, x: int) -> int:
+                return test._fail_once(x)
+
+        fetch = retry(
+            retry_on_exceptions=ValueError,
+            max_calls_total=3,
+            retry_window_after_first_call_in_seconds=1,
+        )(Fetcher())
+
+        with retry_immediately():
+            self.assertEqual(fetch(2), 2)
+        self.assertEqual(self.calls, 2)
+
+
 
 if __name__ == "__main__":
     unittest.main()
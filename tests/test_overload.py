@@ -0,0 +1,138 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+import asyncio
+import os
+import random
+import time
+import unittest
+from unittest import mock
+
+from opnieuw.overload import (
+    CpuPressureDetector,
+    EventLoopLagDetector,
+    OverloadDetector,
+    set_overload_detector,
+)
+from opnieuw.retries import retry
+from opnieuw.test_util import virtual_time
+from tests.utils import AsyncTestCase
+
+
+class FakeDetector(OverloadDetector):
+    def __init__(self, overloaded: bool) -> None:
+        self.overloaded = overloaded
+
+    def is_overloaded(self) -> bool:
+        return self.overloaded
+
+
+class TestLoadShedding(unittest.TestCase):
+    def setUp(self) -> None:
+        self.counter = 0
+
+    def tearDown(self) -> None:
+        set_overload_detector(None)
+
+    @retry(
+        retry_on_exceptions=ValueError,
+        max_calls_total=3,
+        retry_window_after_first_call_in_seconds=60,
+    )
+    def always_fails(self) -> None:
+        self.counter += 1
+        raise ValueError
+
+    def test_retries_are_shed_during_overload(self) -> None:
+        set_overload_detector(FakeDetector(overloaded=True))
+        with virtual_time() as clock:
+            with self.assertRaises(ValueError):
+                self.always_fails()
+
+        # The first attempt is still made, but it is not retried.
+        self.assertEqual(self.counter, 1)
+        self.assertEqual(clock.time, 0.0)
+
+    @mock.patch.object(random, "uniform", return_value=10.0)
+    def test_retries_are_delayed_during_overload(self, mocked_random) -> None:
+        set_overload_detector(FakeDetector(overloaded=True), delay_factor=2.0)
+        with virtual_time() as clock:
+            with self.assertRaises(ValueError):
+                self.always_fails()
+
+        self.assertEqual(self.counter, 3)
+        self.assertEqual(clock.time, 40.0)
+
+    @mock.patch.object(random, "uniform", return_value=10.0)
+    def test_no_overload(self, mocked_random) -> None:
+        set_overload_detector(FakeDetector(overloaded=False))
+        with virtual_time() as clock:
+            with self.assertRaises(ValueError):
+                self.always_fails()
+
+        self.assertEqual(self.counter, 3)
+        self.assertEqual(clock.time, 20.0)
+
+
+class TestEventLoopLagDetector(AsyncTestCase):
+    def test_detects_blocked_loop(self) -> None:
+        async def _test_inner() -> None:
+            detector = EventLoopLagDetector(
+                interval_seconds=0.01, max_lag_seconds=0.05, smoothing=1.0
+            )
+            detector.start()
+            try:
+                await asyncio.sleep(0.05)
+                self.assertFalse(detector.is_overloaded())
+
+                # Block the event loop, like a CPU heavy callback would.
+                time.sleep(0.2)
+                # Give the overdue probe a chance to run.
+                await asyncio.sleep(0)
+                await asyncio.sleep(0)
+                self.assertTrue(detector.is_overloaded())
+            finally:
+                detector.stop()
+
+        self._run_async(_test_inner())
+
+
+class TestCpuPressureDetector(unittest.TestCase):
+    def test_high_load_average(self) -> None:
+        detector = CpuPressureDetector(
+            sample_interval_seconds=0.0, max_process_cpu_per_core=1000.0
+        )
+        cores = os.cpu_count() or 1
+        with mock.patch.object(os, "getloadavg", return_value=(3.0 * cores, 0.0, 0.0), create=True):
+            time.sleep(0.001)
+            self.assertTrue(detector.is_overloaded())
+        with mock.patch.object(os, "getloadavg", return_value=(0.5 * cores, 0.0, 0.0), create=True):
+            time.sleep(0.001)
+            self.assertFalse(detector.is_overloaded())
+
+    def test_busy_process(self) -> None:
+        cores = os.cpu_count() or 1
+        patch_monotonic = mock.patch.object(time, "monotonic", return_value=100.0)
+        patch_process_time = mock.patch.object(time, "process_time", return_value=0.0)
+        with patch_monotonic as monotonic, patch_process_time as process_time:
+            detector = CpuPressureDetector(
+                sample_interval_seconds=0.0,
+                max_load_per_core=1000.0,
+                max_process_cpu_per_core=0.5,
+            )
+
+            # The process used 40% of all cores during the last second.
+            monotonic.return_value = 101.0
+            process_time.return_value = 0.4 * cores
+            self.assertFalse(detector.is_overloaded())
+
+            # And 60% during the next one.
+            monotonic.return_value = 102.0
+            process_time.return_value = 1.0 * cores
+            self.assertTrue(detector.is_overloaded())
+
+
+if __name__ == "__main__":
+    unittest.main()
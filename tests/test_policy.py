@@ -0,0 +1,174 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+from __future__ import annotations
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from opnieuw.policy import PolicyFile, RetryPolicy, parse_policies
+from opnieuw.retries import retry, set_policies
+from opnieuw.test_util import retry_immediately
+
+POLICIES = b"""
+[policies.policy_test]
+max_calls_total = 5
+retry_window_after_first_call_in_seconds = 10
+"""
+
+
+class TestParsePolicies(unittest.TestCase):
+    def test_parse(self) -> None:
+        self.assertEqual(
+            parse_policies(POLICIES),
+            {
+                "policy_test": RetryPolicy(
+                    max_calls_total=5, retry_window_after_first_call_in_seconds=10
+                )
+            },
+        )
+
+    def test_invalid_policies(self) -> None:
+        with self.assertRaisesRegex(ValueError, "unknown settings"):
+            parse_policies(POLICIES + b"max_calls = 3\n")
+
+        with self.assertRaisesRegex(ValueError, "missing settings"):
+            parse_policies(b"[policies.a]\nmax_calls_total = 3\n")
+
+        with self.assertRaisesRegex(ValueError, "must be an integer"):
+            parse_policies(
+                b"[policies.a]\nmax_calls_total = '3'\n"
+                b"retry_window_after_first_call_in_seconds = 10\n"
+            )
+
+        with self.assertRaisesRegex(ValueError, "must be non-negative"):
+            parse_policies(
+                b"[policies.a]\nmax_calls_total = 3\n"
+                b"retry_window_after_first_call_in_seconds = -1\n"
+            )
+
+
+class TestPolicyFile(unittest.TestCase):
+    def setUp(self) -> None:
+        self.counter = 0
+        self.writes = 0
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "policies.toml")
+        self._write(POLICIES)
+
+    def tearDown(self) -> None:
+        set_policies({})
+        self.tmpdir.cleanup()
+
+    def _write(self, data: bytes) -> None:
+        with open(self.path, "wb") as f:
+            f.write(data)
+        # Make sure that the change is visible even on file systems with a coarse
+        # modification time.
+        self.writes += 1
+        os.utime(self.path, ns=(self.writes, self.writes))
+
+    @retry(
+        retry_on_exceptions=ValueError,
+        max_calls_total=2,
+        retry_window_after_first_call_in_seconds=10,
+        namespace="policy_test",
+    )
+    def always_fails(self) -> None:
+        self.counter += 1
+        raise ValueError
+
+    def _calls(self) -> int:
+        self.counter = 0
+        with retry_immediately("policy_test"):
+            with self.assertRaises(ValueError):
+                self.always_fails()
+        return self.counter
+
+    def test_policy_overrides_decorator(self) -> None:
+        self.assertEqual(self._calls(), 2)
+
+        policy_file = PolicyFile(self.path)
+        policy_file.load()
+        self.assertEqual(self._calls(), 5)
+
+        set_policies({})
+        self.assertEqual(self._calls(), 2)
+
+    def test_reload(self) -> None:
+        policy_file = PolicyFile(self.path)
+        policy_file.load()
+        self.assertFalse(policy_file.reload_if_changed())
+
+        self._write(POLICIES.replace(b"5", b"3"))
+        self.assertTrue(policy_file.reload_if_changed())
+        self.assertEqual(self._calls(), 3)
+
+        # A broken file keeps the previous policies in place.
+        self._write(b"[policies.policy_test\n")
+        with self.assertLogs("opnieuw.policy", "WARNING"):
+            self.assertFalse(policy_file.reload_if_changed())
+        self.assertEqual(self._calls(), 3)
+        self.assertFalse(policy_file.reload_if_changed())
+
+    def test_concurrent_reloads_load_a_change_once(self) -> None:
+        policy_file = PolicyFile(self.path)
+        policy_file.load()
+        self._write(POLICIES.replace(b"5", b"3"))
+
+        parsing = threading.Event()
+        release = threading.Event()
+        results: list[bool] = []
+
+        def slow_parse(data: bytes) -> dict[str, RetryPolicy]:
+            parsing.set()
+            release.wait(5.0)
+            return parse_policies(data)
+
+        def reload() -> None:
+            results.append(policy_file.reload_if_changed())
+
+        with mock.patch("opnieuw.policy.parse_policies", side_effect=slow_parse) as parse:
+            first = threading.Thread(target=reload)
+            first.start()
+            self.assertTrue(parsing.wait(5.0))
+            # This reload sees the same change, while the first one is loading it.
+            second = threading.Thread(target=reload)
+            second.start()
+            time.sleep(0.05)
+            release.set()
+            first.join()
+            second.join()
+
+        self.assertEqual(sorted(results), [False, True])
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(self._calls(), 3)
+
+    def test_policy_for_namespace_registered_later(self) -> None:
+        set_policies(
+            {
+                "registered_later": RetryPolicy(
+                    max_calls_total=4, retry_window_after_first_call_in_seconds=10
+                )
+            }
+        )
+
+        @retry(retry_on_exceptions=ValueError, namespace="registered_later")
+        def fails() -> None:
+            self.counter += 1
+            raise ValueError
+
+        with retry_immediately("registered_later"):
+            with self.assertRaises(ValueError):
+                fails()
+        self.assertEqual(self.counter, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+import random
+import unittest
+from unittest import mock
+
+from opnieuw import Priority
+from opnieuw.clock import DummyClock
+from opnieuw.priority import RetryCapacity, set_retry_capacity, with_priority
+from opnieuw.retries import retry
+from opnieuw.test_util import virtual_time
+
+
+class TestRetryCapacity(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clock = DummyClock()
+        self.capacity = RetryCapacity(retries_per_second=1.0, burst=4, clock=self.clock)
+
+    def test_low_priority_is_shed_first(self) -> None:
+        # LOW keeps half of the bucket in reserve, NORMAL a quarter, HIGH nothing.
+        self.assertTrue(self.capacity.try_acquire(Priority.LOW))
+        self.assertTrue(self.capacity.try_acquire(Priority.LOW))
+        self.assertFalse(self.capacity.try_acquire(Priority.LOW))
+        self.assertTrue(self.capacity.try_acquire(Priority.NORMAL))
+        self.assertFalse(self.capacity.try_acquire(Priority.NORMAL))
+        self.assertTrue(self.capacity.try_acquire(Priority.HIGH))
+        self.assertFalse(self.capacity.try_acquire(Priority.HIGH))
+
+    def test_refill(self) -> None:
+        for _ in range(4):
+            self.assertTrue(self.capacity.try_acquire(Priority.HIGH))
+        self.assertFalse(self.capacity.try_acquire(Priority.HIGH))
+
+        self.clock.advance_to(1.0)
+        self.assertTrue(self.capacity.try_acquire(Priority.HIGH))
+
+        self.clock.advance_to(100.0)
+        self.assertEqual(self.capacity.tokens, 4.0)
+
+
+class TestPriorityRetries(unittest.TestCase):
+    def setUp(self) -> None:
+        self.counter = 0
+        self.clock = DummyClock()
+        set_retry_capacity(
+            RetryCapacity(retries_per_second=0.0, burst=4, clock=self.clock),
+            namespace="prioritized",
+        )
+
+    def tearDown(self) -> None:
+        set_retry_capacity(None, namespace="prioritized")
+
+    @retry(
+        retry_on_exceptions=ValueError,
+        max_calls_total=10,
+        retry_window_after_first_call_in_seconds=1000,
+        namespace="prioritized",
+        priority=Priority.LOW,
+    )
+    def background_job(self) -> None:
+        self.counter += 1
+        raise ValueError
+
+    @mock.patch.object(random, "uniform", return_value=1.0)
+    def test_decorator_priority(self, mocked_random) -> None:
+        with virtual_time("prioritized", clock=self.clock):
+            with self.assertRaises(ValueError):
+                self.background_job()
+
+        # LOW may only use half of the four retries, and backs off twice as long.
+        self.assertEqual(self.counter, 3)
+        self.assertEqual(self.clock.time, 4.0)
+
+    @mock.patch.object(random, "uniform", return_value=1.0)
+    def test_context_priority_overrides_decorator(self, mocked_random) -> None:
+        with virtual_time("prioritized", clock=self.clock):
+            with with_priority(Priority.HIGH):
+                with self.assertRaises(ValueError):
+                    self.background_job()
+
+        self.assertEqual(self.counter, 5)
+        self.assertEqual(self.clock.time, 4.0)
+
+    def test_other_namespaces_are_unlimited(self) -> None:
+        @retry(
+            retry_on_exceptions=ValueError,
+            max_calls_total=10,
+            retry_window_after_first_call_in_seconds=1000,
+            priority=Priority.LOW,
+        )
+        def unlimited() -> None:
+            self.counter += 1
+            raise ValueError
+
+        with virtual_time():
+            with self.assertRaises(ValueError):
+                unlimited()
+
+        self.assertEqual(self.counter, 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
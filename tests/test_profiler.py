@@ -0,0 +1,147 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+import functools
+import io
+import random
+import threading
+import unittest
+from unittest import mock
+
+from opnieuw.profiler import RetryProfiler, disable_profiler, enable_profiler
+from opnieuw.retries import retry
+from opnieuw.test_util import virtual_time
+from tests.utils import AsyncTestCase
+
+
+class TestRetryProfiler(AsyncTestCase):
+    def setUp(self) -> None:
+        self.counter = 0
+        self.profiler = enable_profiler(RetryProfiler())
+
+    def tearDown(self) -> None:
+        disable_profiler()
+
+    @retry(
+        retry_on_exceptions=ValueError,
+        max_calls_total=3,
+        retry_window_after_first_call_in_seconds=30,
+        namespace="profiled",
+    )
+    def succeeds_third_time(self) -> None:
+        self.counter += 1
+        if self.counter < 3:
+            raise ValueError
+
+    @retry(
+        retry_on_exceptions=ValueError,
+        max_calls_total=3,
+        retry_window_after_first_call_in_seconds=30,
+    )
+    async def always_fails(self) -> None:
+        raise ValueError
+
+    @mock.patch.object(random, "uniform", return_value=1.5)
+    def test_records_success(self, mocked_random) -> None:
+        with virtual_time("profiled"):
+            self.succeeds_third_time()
+
+        [stats] = self.profiler.stats()
+        self.assertTrue(stats.name.endswith("TestRetryProfiler.succeeds_third_time"))
+        self.assertEqual(stats.namespace, "profiled")
+        self.assertEqual(stats.calls, 1)
+        self.assertEqual(stats.attempts, 3)
+        self.assertEqual(stats.successes, 1)
+        self.assertEqual(stats.give_ups, 0)
+        self.assertEqual(stats.backoff_seconds, 3.0)
+        self.assertEqual(stats.mean_time_to_success_seconds, 3.0)
+
+    @mock.patch.object(random, "uniform", return_value=1.5)
+    def test_records_give_up(self, mocked_random) -> None:
+        with virtual_time():
+            for _ in range(2):
+                with self.assertRaises(ValueError):
+                    self._run_async(self.always_fails())
+
+        [stats] = self.profiler.stats()
+        self.assertIsNone(stats.namespace)
+        self.assertEqual(stats.calls, 2)
+        self.assertEqual(stats.attempts, 6)
+        self.assertEqual(stats.give_ups, 2)
+        self.assertEqual(stats.backoff_seconds, 6.0)
+        self.assertIsNone(stats.mean_time_to_success_seconds)
+
+    def test_call_sites_of_partials_and_callable_objects(self) -> None:
+        def fetch_user(user_id: int) -> int:
+            return user_id
+
+        def fetch_order(order_id: int) -> int:
+            return order_id
+
+        class Fetcher:
+            def __call__(self) -> int:
+                return 0
+
+        decorate = retry(retry_on_exceptions=ValueError)
+        decorate(functools.partial(fetch_user, 1))()
+        decorate(functools.partial(functools.partial(fetch_order), 2))()
+        decorate(Fetcher())()
+
+        # Every function gets its own row, named after the wrapped function.
+        names = sorted(stats.name.rsplit(".", 1)[1] for stats in self.profiler.stats())
+        self.assertEqual(names, ["Fetcher", "fetch_order", "fetch_user"])
+
+    def test_overflowing_call_sites_are_aggregated(self) -> None:
+        profiler = RetryProfiler(max_call_sites=1)
+        profiler.record(("a", None), 0, 1, 0.0, 0.0)
+        profiler.record(("b", None), 1, 2, 1.0, 1.0)
+        profiler.record(("c", None), 1, 2, 2.0, 1.0)
+
+        stats = profiler.stats()
+        self.assertEqual(
+            [(s.name, s.calls, s.backoff_seconds) for s in stats],
+            [("<other>", 2, 3.0), ("a", 1, 0.0)],
+        )
+
+    def test_shards_are_summed(self) -> None:
+        profiler = RetryProfiler(shards=4)
+
+        def _record_many() -> None:
+            for _ in range(1000):
+                profiler.record(("shared", None), 1, 2, 0.5, 1.0)
+
+        threads = [threading.Thread(target=_record_many) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        [stats] = profiler.stats()
+        self.assertEqual(stats.calls, 8000)
+        self.assertEqual(stats.attempts, 16000)
+        self.assertEqual(stats.give_ups, 8000)
+        self.assertEqual(stats.backoff_seconds, 4000.0)
+
+    def test_exports(self) -> None:
+        self.profiler.record(("mod.fetch", "http"), 0, 2, 1.25, 2.0)
+        self.profiler.record(("mod.sync", None), 1, 3, 0.5, 2.0)
+
+        out = io.StringIO()
+        self.profiler.write_collapsed(out)
+        self.assertEqual(
+            out.getvalue(),
+            "opnieuw;http;mod;fetch 1250\nopnieuw;<default>;mod;sync 500\n",
+        )
+
+        report = self.profiler.report().splitlines()
+        self.assertEqual(len(report), 3)
+        self.assertIn("mod.fetch [http]", report[1])
+
+        self.profiler.reset()
+        self.assertEqual(self.profiler.stats(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
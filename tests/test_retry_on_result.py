@@ -0,0 +1,88 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+import unittest
+
+from opnieuw.cache import ResultCache
+from opnieuw.retries import retry
+from opnieuw.test_util import retry_immediately
+from tests.utils import AsyncTestCase
+
+
+def _is_throttled(response: str) -> bool:
+    return response == "throttled"
+
+
+class TestRetryOnResult(AsyncTestCase):
+    def setUp(self) -> None:
+        self.responses: list[str] = []
+        self.calls = 0
+
+    def _next_response(self) -> str:
+        self.calls += 1
+        response = self.responses.pop(0)
+        if response == "error":
+            raise ConnectionError
+        return response
+
+    @retry(
+        retry_on_exceptions=ConnectionError,
+        max_calls_total=3,
+        retry_window_after_first_call_in_seconds=10,
+        retry_on_result=_is_throttled,
+    )
+    def fetch(self) -> str:
+        return self._next_response()
+
+    @retry(
+        retry_on_exceptions=ConnectionError,
+        max_calls_total=3,
+        retry_window_after_first_call_in_seconds=10,
+        retry_on_result=_is_throttled,
+    )
+    async def fetch_async(self) -> str:
+        return self._next_response()
+
+    def test_retries_until_accepted(self) -> None:
+        self.responses = ["throttled", "error", "ok"]
+        with retry_immediately():
+            self.assertEqual(self.fetch(), "ok")
+        self.assertEqual(self.calls, 3)
+
+    def test_returns_last_result_when_exhausted(self) -> None:
+        self.responses = ["throttled", "throttled", "throttled", "ok"]
+        with retry_immediately():
+            self.assertEqual(self.fetch(), "throttled")
+        self.assertEqual(self.calls, 3)
+
+    def test_async(self) -> None:
+        self.responses = ["throttled", "ok"]
+        with retry_immediately():
+            self.assertEqual(self._run_async(self.fetch_async()), "ok")
+        self.assertEqual(self.calls, 2)
+
+    def test_rejected_results_are_not_cached(self) -> None:
+        cache = ResultCache(ttl_seconds=60)
+
+        @retry(
+            retry_on_exceptions=ConnectionError,
+            max_calls_total=2,
+            retry_window_after_first_call_in_seconds=10,
+            retry_on_result=_is_throttled,
+            cache=cache,
+        )
+        def fetch() -> str:
+            return self._next_response()
+
+        self.responses = ["throttled", "throttled", "ok"]
+        with retry_immediately():
+            self.assertEqual(fetch(), "throttled")
+            self.assertEqual(fetch(), "ok")
+            self.assertEqual(fetch(), "ok")
+        self.assertEqual(self.calls, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
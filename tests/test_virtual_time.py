@@ -0,0 +1,180 @@
+# Opnieuw: Retries for humans
+# Copyright 2019 Channable
+#
+# Licensed under the 3-clause BSD license, see the LICENSE file in the repository root.
+
+from __future__ import annotations
+
+import asyncio
+import random
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from opnieuw.clock import DummyClock
+from opnieuw.retries import retry
+from opnieuw.test_util import virtual_time
+from tests.utils import AsyncTestCase
+
+
+def _upper_bound(a: float, b: float) -> float:
+    return b
+
+
+class TestVirtualTime(AsyncTestCase):
+    def setUp(self) -> None:
+        self.counter = 0
+
+    @retry(
+        retry_on_exceptions=ValueError,
+        max_calls_total=4,
+        retry_window_after_first_call_in_seconds=70,
+        namespace="virtual_time",
+    )
+    def always_fails(self) -> None:
+        self.counter += 1
+        raise ValueError
+
+    @retry(
+        retry_on_exceptions=ValueError,
+        max_calls_total=4,
+        retry_window_after_first_call_in_seconds=70,
+        namespace="virtual_time",
+    )
+    async def always_fails_async(self) -> None:
+        self.counter += 1
+        raise ValueError
+
+    @mock.patch.object(random, "uniform", side_effect=_upper_bound)
+    def test_sleeps_advance_virtual_time(self, mocked_random) -> None:
+        start = time.monotonic()
+        with virtual_time("virtual_time") as clock:
+            with self.assertRaises(ValueError):
+                self.always_fails()
+
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(self.counter, 4)
+        # The base backoff is 70 / 7 = 10 seconds, so we slept 10 + 20 + 40 seconds.
+        self.assertAlmostEqual(clock.time, 70.0)
+
+    @mock.patch.object(random, "uniform", side_effect=_upper_bound)
+    def test_async_sleeps_advance_virtual_time(self, mocked_random) -> None:
+        with virtual_time("virtual_time") as clock:
+            with self.assertRaises(ValueError):
+                self._run_async(self.always_fails_async())
+
+        self.assertEqual(self.counter, 4)
+        self.assertAlmostEqual(clock.time, 70.0)
+
+    @mock.patch.object(random, "uniform", side_effect=_upper_bound)
+    def test_retry_window_is_respected(self, mocked_random) -> None:
+        clock = DummyClock()
+
+        @retry(
+            retry_on_exceptions=ValueError,
+            max_calls_total=3,
+            retry_window_after_first_call_in_seconds=60,
+        )
+        def slow_call() -> None:
+            self.counter += 1
+            # The call itself takes 50 seconds, so the first backoff of 20
+            # seconds no longer fits in the retry window.
+            clock.advance_to(clock.time + 50)
+            raise ValueError
+
+        with virtual_time(clock=clock):
+            with self.assertRaises(ValueError):
+                slow_call()
+
+        self.assertEqual(self.counter, 1)
+        self.assertEqual(clock.time, 50.0)
+
+    @mock.patch.object(random, "uniform", side_effect=_upper_bound)
+    def test_concurrent_async_sleeps_overlap(self, mocked_random) -> None:
+        attempts = [0] * 5
+
+        @retry(
+            retry_on_exceptions=ValueError,
+            max_calls_total=4,
+            retry_window_after_first_call_in_seconds=70,
+        )
+        async def always_fails(i: int) -> None:
+            attempts[i] += 1
+            raise ValueError
+
+        async def run_all() -> list[BaseException | None]:
+            return await asyncio.gather(
+                *(always_fails(i) for i in range(5)), return_exceptions=True
+            )
+
+        with virtual_time() as clock:
+            results = self._run_async(run_all())
+
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        # Every call sleeps 10 + 20 + 40 seconds, at the same time as the others.
+        self.assertEqual(attempts, [4] * 5)
+        self.assertAlmostEqual(clock.time, 70.0)
+
+    @mock.patch.object(random, "uniform", side_effect=_upper_bound)
+    def test_concurrent_sleeps_in_threads_overlap(self, mocked_random) -> None:
+        clock = DummyClock()
+        # Leave the threads plenty of time to go to sleep, even on a busy machine.
+        clock.thread_grace_seconds = 0.02
+        attempts = [0] * 5
+        started = threading.Barrier(5)
+
+        @retry(
+            retry_on_exceptions=ValueError,
+            max_calls_total=4,
+            retry_window_after_first_call_in_seconds=70,
+        )
+        def always_fails(i: int) -> None:
+            attempts[i] += 1
+            raise ValueError
+
+        # The clock is replaced per context, so every thread replaces it itself.
+        def run_in_virtual_time(i: int) -> None:
+            with virtual_time(clock=clock):
+                started.wait()
+                with self.assertRaises(ValueError):
+                    always_fails(i)
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            list(executor.map(run_in_virtual_time, range(5)))
+
+        self.assertEqual(attempts, [4] * 5)
+        self.assertAlmostEqual(clock.time, 70.0)
+
+    def test_sleepers_wake_up_in_order(self) -> None:
+        clock = DummyClock()
+        woke_up: list[tuple[str, float]] = []
+
+        async def sleeper(name: str, seconds: float) -> None:
+            await clock.async_sleep(seconds)
+            woke_up.append((name, clock.time))
+            await clock.async_sleep(seconds)
+            woke_up.append((name, clock.time))
+
+        async def run_all() -> None:
+            await asyncio.gather(sleeper("slow", 30.0), sleeper("fast", 20.0))
+
+        self._run_async(run_all())
+
+        self.assertEqual(
+            woke_up, [("fast", 20.0), ("slow", 30.0), ("fast", 40.0), ("slow", 60.0)]
+        )
+
+    def test_other_namespaces_use_real_clock(self) -> None:
+        with virtual_time("other_namespace") as clock:
+            with self.assertRaises(ValueError):
+                with mock.patch.object(random, "uniform", return_value=0.01):
+                    self.always_fails()
+
+        self.assertEqual(self.counter, 4)
+        self.assertEqual(clock.time, 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()